@@ -0,0 +1,158 @@
+# Interchange format between parse-acl.py and import-acl.py
+# dj0Nz Oct 2024
+#
+# Objects and rules files are json lines (one json object per line), optionally gzip
+# compressed (file name ending with .gz). The first line is a header naming format,
+# version and kind of file:
+#   {"format": "cptools-acl", "version": 1, "kind": "rules"}
+# Objects:
+#   {"type": "network", "address": "10.1.1.0/24"}         (hosts are /32 networks)
+#   {"type": "group", "name": "grp_acl_...", "members": ["10.1.1.0/30", "10.1.1.7/32"]}
+# Rules (in rulebase order, icmp-type only for icmp, operator/port only for tcp and udp):
+#   {"acl": "EDGE", "lines": [9, 10], "protocol": "tcp", "source": "any", "destination": "10.9.9.9/32",
+#    "operator": "eq", "port": "443", "action": "accept"}
+# Readers skip fields they don't know, so fields can be added without a new version.
+
+import gzip, hashlib, json
+
+format_name = 'cptools-acl'
+format_version = 1
+
+# Cisco port names (tcp and udp) and their numbers
+port_names = {
+    'tcp' : { 'bgp' : 179, 'chargen' : 19, 'cmd' : 514, 'daytime' : 13, 'discard' : 9, 'domain' : 53, 'echo' : 7,
+              'exec' : 512, 'finger' : 79, 'ftp' : 21, 'ftp-data' : 20, 'gopher' : 70, 'hostname' : 101, 'ident' : 113,
+              'irc' : 194, 'klogin' : 543, 'kshell' : 544, 'login' : 513, 'lpd' : 515, 'nntp' : 119, 'pop2' : 109,
+              'pop3' : 110, 'smtp' : 25, 'sunrpc' : 111, 'tacacs' : 49, 'talk' : 517, 'telnet' : 23, 'time' : 37,
+              'uucp' : 540, 'whois' : 43, 'www' : 80 },
+    'udp' : { 'biff' : 512, 'bootpc' : 68, 'bootps' : 67, 'discard' : 9, 'dnsix' : 195, 'domain' : 53, 'echo' : 7,
+              'isakmp' : 500, 'mobile-ip' : 434, 'nameserver' : 42, 'netbios-dgm' : 138, 'netbios-ns' : 137,
+              'netbios-ss' : 139, 'ntp' : 123, 'rip' : 520, 'snmp' : 161, 'snmptrap' : 162, 'sunrpc' : 111,
+              'syslog' : 514, 'tacacs' : 49, 'talk' : 517, 'tftp' : 69, 'time' : 37, 'who' : 513, 'xdmcp' : 177 }
+}
+
+# raised if a file is not in this format, has another kind or a newer version
+class FormatError(ValueError):
+    pass
+
+# open a file for reading or writing text, gzip compressed if the name ends with .gz
+# (reading also detects gzip files by their content)
+def open_file(path,mode='r'):
+    if 'r' in mode:
+        with open(path, 'rb') as file:
+            compressed = file.read(2) == b'\x1f\x8b'
+    else:
+        compressed = path.endswith('.gz')
+    if compressed:
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+# writes records of one kind ('objects' or 'rules') line by line, use as context manager:
+#   with aclformat.Writer('rules.jsonl', 'rules') as rules:
+#       rules.write(aclformat.rule_record(rule))
+class Writer:
+    def __init__(self,path,kind):
+        self.path = path
+        self.kind = kind
+        self.count = 0
+        self.file = open_file(path, 'w')
+        self.file.write(json.dumps({ 'format' : format_name, 'version' : format_version, 'kind' : kind }) + '\n')
+
+    def write(self,record):
+        self.file.write(json.dumps(record) + '\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+# reads records of one kind from a file, one at a time (generator), so big files are never
+# loaded completely. Yields (line number, record).
+def read(path,kind):
+    with open_file(path) as file:
+        try:
+            header = json.loads(file.readline())
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get('format') != format_name:
+            raise FormatError(path + ': not a ' + format_name + ' file')
+        if header.get('kind') != kind:
+            raise FormatError(path + ': contains ' + str(header.get('kind')) + ', not ' + kind)
+        if not isinstance(header.get('version'), int) or header['version'] > format_version:
+            raise FormatError(path + ': version ' + str(header.get('version')) + ' not supported (max. ' + str(format_version) + ')')
+        for line_number, line in enumerate(file, start=2):
+            if line.strip():
+                yield line_number, json.loads(line)
+
+# object record from parse-acl.py object: 'address/prefix length' or group 'name member member...'
+def object_record(netobject):
+    if ' ' in netobject:
+        members = netobject.split()
+        return { 'type' : 'group', 'name' : members[0], 'members' : members[1:] }
+    return { 'type' : 'network', 'address' : netobject }
+
+# rule record from parse-acl.py rule tuple:
+# (protocol, source, destination, icmp type or 'any', action) for ip and icmp,
+# (protocol, source, destination, operator, port or 'any', action) for tcp and udp
+def rule_record(rule,acl=None,lines=None):
+    record = {}
+    if acl is not None:
+        record['acl'] = acl
+    if lines is not None:
+        record['lines'] = lines
+    record.update({ 'protocol' : rule[0], 'source' : rule[1], 'destination' : rule[2] })
+    if rule[0] == 'icmp':
+        record['icmp-type'] = rule[3]
+    elif len(rule) == 6:
+        record['operator'] = rule[3]
+        record['port'] = rule[4]
+    record['action'] = rule[-1]
+    return record
+
+# content hash of a record, e.g. to recognize unchanged rules in a later import.
+# the acl line numbers are left out, they change whenever lines are added above.
+def record_hash(record):
+    content = { key : value for key, value in record.items() if key != 'lines' }
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()[:16]
+
+# port or port name as number, None if the name is unknown
+def port_number(protocol,port):
+    if port.isdigit():
+        return int(port)
+    return port_names.get(protocol, {}).get(port)
+
+# low and high port of a range record ('1000-2000'), None if a port name is unknown. port names
+# may have dashes themselves ('ftp-data-telnet' from older files), every split is tried.
+def port_range(protocol,port):
+    parts = port.split('-')
+    for split in range(1, len(parts)):
+        low = port_number(protocol, '-'.join(parts[:split]))
+        high = port_number(protocol, '-'.join(parts[split:]))
+        if low is not None and high is not None:
+            return low, high
+    return None
+
+# ports of a tcp/udp rule record as check point service ports ('443', '1000-2000'), a list
+# because neq needs two ranges. None if a port name is unknown or the port range is empty.
+def service_ports(protocol,operator,port):
+    if port == 'any':
+        ranges = [(1, 65535)]
+    elif operator == 'range':
+        if port_range(protocol, port) is None:
+            return None
+        ranges = [port_range(protocol, port)]
+    else:
+        value = port_number(protocol, port)
+        if value is None:
+            return None
+        ranges = { 'eq' : [(value, value)], 'lt' : [(1, value - 1)], 'gt' : [(value + 1, 65535)],
+                   'neq' : [(1, value - 1), (value + 1, 65535)] }.get(operator, [(value, value)])
+    ranges = [(low, high) for low, high in ranges if low <= high]
+    if not ranges:
+        return None
+    return [str(low) if low == high else str(low) + '-' + str(high) for low, high in ranges]
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+
+# Benchmark for the Cisco ACL conversion in parse-acl.py
+# Generates a synthetic Cisco extended ACL, runs the conversion phases of parse-acl.py
+# (parse, objects, rules, dedupe) separately, measures time and peak memory of every phase
+# and appends the results to a json lines file. With --compare, the results are compared
+# with the last run using the same parameters, so performance regressions show up.
+#
+# Usage examples:
+# ./bench-acl.py --entries 20000
+# ./bench-acl.py --entries 5000 --dup 0.2 --proto tcp=0.8,udp=0.2 --compare
+# ./bench-acl.py --entries 1000 --write acl.txt   (only write the generated acl)
+#
+# dj0Nz
+
+import argparse, importlib.util, json, os, random, subprocess, sys, time, tracemalloc
+
+##########
+# Variables
+
+# parse-acl.py (has a dash in its name, so it is loaded from file) and results file
+parse_acl = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parse-acl.py')
+results_file = 'bench-acl-results.jsonl'
+
+# icmp types and tcp/udp ports used in generated acls
+icmp_types = ['echo', 'echo-reply', 'unreachable', 'time-exceeded', 'packet-too-big']
+tcp_ports = ['22', '25', '80', '443', '445', '1433', '3389', '8080', 'www', 'smtp']
+udp_ports = ['53', '67', '123', '161', '514', 'domain', 'snmp', 'ntp']
+
+# End variables section
+##########
+
+##########
+# Functions
+
+# Load parse-acl.py as module. The main program only runs when called as script.
+def load_converter(path):
+    spec = importlib.util.spec_from_file_location('parse_acl', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Parse mix argument like 'tcp=0.5,udp=0.2,icmp=0.1,ip=0.2' into weights
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        key, value = item.split('=')
+        mix[key.strip()] = float(value)
+    return mix
+
+# Random source or destination: host, network with wildcard mask or any.
+# pool_size limits the number of different addresses, so objects repeat like in real acls.
+def address(rng,mix,pool_size):
+    kind = rng.choices(list(mix), weights=list(mix.values()))[0]
+    num = rng.randrange(pool_size)
+    if kind == 'host':
+        return 'host 10.' + str(num >> 16 & 255) + '.' + str(num >> 8 & 255) + '.' + str(num & 255)
+    elif kind == 'wildcard':
+        prefix = rng.choice([16, 20, 24, 26, 28])
+        wildcard = 2 ** (32 - prefix) - 1
+        network = ((172 << 24) | (16 + (num & 15)) << 16 | (num >> 4 & 255) << 8) & ~wildcard & 0xffffffff
+        return dotted(network) + ' ' + dotted(wildcard)
+    else:
+        return 'any'
+
+def dotted(number):
+    return '.'.join(str(number >> shift & 255) for shift in (24, 16, 8, 0))
+
+# Generate synthetic named extended acl. Output: list of lines like readlines() returns them.
+# - entries  : number of access control entries
+# - addr_mix : weights for host, wildcard and any addresses
+# - proto_mix: weights for tcp, udp, icmp and ip entries
+# - dup      : fraction of entries repeating an earlier entry
+# - pool     : number of different addresses per kind
+def generate_acl(entries,addr_mix,proto_mix,dup=0.05,pool=2000,seed=1):
+    rng = random.Random(seed)
+    lines = ['ip access-list extended BENCH\n']
+    aces = []
+    for num in range(entries):
+        if aces and rng.random() < dup:
+            aces.append(rng.choice(aces))
+            continue
+        action = 'deny' if rng.random() < 0.1 else 'permit'
+        proto = rng.choices(list(proto_mix), weights=list(proto_mix.values()))[0]
+        src = address(rng, addr_mix, pool)
+        dst = address(rng, addr_mix, pool)
+        if src == 'any' and dst == 'any':
+            dst = address(rng, { 'host' : 1 }, pool)
+        ace = ' ' + action + ' ' + proto + ' ' + src + ' ' + dst
+        if proto == 'icmp' and rng.random() < 0.7:
+            ace += ' ' + rng.choice(icmp_types)
+        elif proto in ('tcp', 'udp'):
+            ports = tcp_ports if proto == 'tcp' else udp_ports
+            choice = rng.random()
+            if choice < 0.75:
+                ace += ' eq ' + rng.choice(ports)
+            elif choice < 0.85:
+                low = rng.randrange(1024, 60000)
+                ace += ' range ' + str(low) + ' ' + str(low + rng.randrange(1, 100))
+            elif choice < 0.9:
+                ace += ' gt ' + str(rng.randrange(1024, 60000))
+            if proto == 'tcp' and rng.random() < 0.05:
+                ace += ' established'
+        if rng.random() < 0.1:
+            ace += ' log'
+        aces.append(ace + '\n')
+    return lines + aces
+
+# Run one conversion phase, returns result, seconds and peak memory in bytes (if traced)
+def run_phase(function,*args,trace=False):
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+# All phases once. Output: dict phase -> [seconds, peak bytes], object and rule count
+def run_pipeline(converter,lines,trace=False):
+    phases = {}
+    acls, seconds, peak = run_phase(converter.parse_acls, lines, trace=trace)
+    phases['parse'] = [seconds, peak]
+    netobjects, seconds, peak = run_phase(converter.collect_objects, acls, trace=trace)
+    phases['objects'] = [seconds, peak]
+    (candidates, skipped), seconds, peak = run_phase(converter.build_rules, acls, netobjects, trace=trace)
+    phases['rules'] = [seconds, peak]
+    (rules, removed), seconds, peak = run_phase(converter.dedupe_rules, candidates, trace=trace)
+    phases['dedupe'] = [seconds, peak]
+    return phases, len(netobjects), len(rules)
+
+# Current git commit (or 'unknown'), to see which version produced a result
+def version():
+    try:
+        output = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                                cwd=os.path.dirname(parse_acl), check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# Last stored result with the same parameters
+def last_result(params):
+    last = None
+    if os.path.isfile(results_file):
+        with open(results_file) as file:
+            for line in file:
+                entry = json.loads(line)
+                if entry['params'] == params:
+                    last = entry
+    return last
+
+# End functions section
+##########
+
+##################
+### main program
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark parse-acl.py with a synthetic Cisco extended ACL.')
+    parser.add_argument('--entries', type=int, default=5000, help='number of acl entries (default 5000)')
+    parser.add_argument('--addr', default='host=0.6,wildcard=0.3,any=0.1', help='address mix (host/wildcard/any weights)')
+    parser.add_argument('--proto', default='tcp=0.5,udp=0.2,icmp=0.15,ip=0.15', help='protocol mix (tcp/udp/icmp/ip weights)')
+    parser.add_argument('--dup', type=float, default=0.05, help='fraction of duplicate entries')
+    parser.add_argument('--pool', type=int, default=2000, help='number of different addresses per kind')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs, the best one counts (default 3)')
+    parser.add_argument('--converter', default=parse_acl, help='parse-acl.py to benchmark')
+    parser.add_argument('--results', default=results_file, help='results file (json lines)')
+    parser.add_argument('--compare', action='store_true', help='compare with last result with same parameters')
+    parser.add_argument('--write', help='only write generated acl to this file')
+    args = parser.parse_args()
+    results_file = args.results
+
+    params = { 'entries' : args.entries, 'addr' : args.addr, 'proto' : args.proto, 'dup' : args.dup, 'pool' : args.pool, 'seed' : args.seed }
+    lines = generate_acl(args.entries, parse_mix(args.addr), parse_mix(args.proto), args.dup, args.pool, args.seed)
+    if args.write:
+        with open(args.write, 'w') as file:
+            file.writelines(lines)
+        quit()
+
+    converter = load_converter(args.converter)
+
+    # timing runs without tracemalloc (it slows everything down), one extra run for memory
+    best = None
+    for run in range(args.repeat):
+        phases, objects, rules = run_pipeline(converter, lines)
+        if best is None or sum(phase[0] for phase in phases.values()) < sum(phase[0] for phase in best.values()):
+            best = phases
+    memory, objects, rules = run_pipeline(converter, lines, trace=True)
+
+    result = {
+        'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'version' : version(),
+        'python' : sys.version.split()[0],
+        'params' : params,
+        'objects' : objects,
+        'rules' : rules,
+        'seconds' : { phase : round(best[phase][0], 6) for phase in best },
+        'peak_bytes' : { phase : memory[phase][1] for phase in memory }
+    }
+    previous = last_result(params) if args.compare else None
+
+    print('ACL entries: ' + str(args.entries) + ', objects: ' + str(objects) + ', rules: ' + str(rules))
+    print('{:<10}{:>12}{:>14}{:>12}'.format('phase', 'seconds', 'peak MiB', 'change'))
+    for phase in result['seconds']:
+        change = ''
+        if previous and previous['seconds'].get(phase):
+            change = '{:+.1f}%'.format((result['seconds'][phase] / previous['seconds'][phase] - 1) * 100)
+        print('{:<10}{:>12.4f}{:>14.2f}{:>12}'.format(phase, result['seconds'][phase], result['peak_bytes'][phase] / 2 ** 20, change))
+    print('{:<10}{:>12.4f}'.format('total', sum(result['seconds'].values())))
+    if previous:
+        print('Compared with ' + previous['version'] + ' from ' + previous['time'])
+
+    with open(results_file, 'a') as file:
+        file.write(json.dumps(result) + '\n')
+
+### end main program
+##################
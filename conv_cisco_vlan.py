@@ -49,8 +49,8 @@ dhcp_two = '192.168.10.9'
 iphelper = False
 cisco_config = []
 
-# API Login
-sid = cpapi.login(cp_mgmt,keyfile)
+# API Login, Session vom letzten Lauf wird wiederverwendet, falls noch gültig
+sid = cpapi.login(cp_mgmt,keyfile,cache=True)
 
 # Cluster Member Namen ermitteln
 command = 'show-simple-cluster'
@@ -161,7 +161,5 @@ for num in range(len(cisco_config)):
 resp = cpapi.publish(cp_mgmt,sid)
 print(resp)
 
-# API Logout
-resp = cpapi.logout(cp_mgmt,sid)
-if not resp == 'OK':
-    print(resp)
+# Kein Logout, die Session bleibt für den nächsten Lauf im Cache
+cpapi.close(cp_mgmt)
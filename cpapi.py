@@ -1,54 +1,1297 @@
 # A basic set of Check Point Web API functions to include in Python scripts
 # dj0Nz Oct 2024
 
-import os, requests, json, datetime
+import os, requests, json, netrc, asyncio, random, time, hashlib, sqlite3, threading, zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# aiohttp is only needed for the AsyncClient, everything else works without it
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 # next two lines needed to suppress warnings if self signed certificates are used
 from urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
 
+# raised by functions that cannot return a [status, json] pair, e.g. the page iterators.
+# status and data are the same as the call function would have returned.
+class ApiError(Exception):
+    def __init__(self,command,status,data):
+        self.command = command
+        self.status = status
+        self.data = data
+        super().__init__(command + ': ' + str(status) + ' ' + str(data.get('message', '')))
+
+# raised by Client.call if the session expired with changes that were not published yet. they
+# are gone with it, a new login would go on without them (see Client.unpublished)
+class SessionExpired(ApiError):
+    pass
+
+# congestion control for the calls of a client, AIMD like tcp. the number of calls in flight
+# (window) grows by one per window of calls answered in time and is cut in half if the server
+# pushes back: 'throttle' (429, server busy), 'lock' (object locked by another session), 'error'
+# (5xx) or 'slow' (over min_latency and latency_factor times the lowest latency seen for the
+# command, that one slowly forgotten). after
+# a throttle, calls are also paced: rate is set to half of the calls per second started before
+# and grows by rate_step per second from there. one decrease per round trip (rate: per second)
+# at most, the responses to the calls that were already in flight are the same signal.
+# input:
+# - max_in_flight : upper limit (and start value) of the window, keep it <= pool_size
+# - max_rate      : upper limit of calls per second, None for no limit
+class Controller:
+    decrease = 0.5
+    latency_factor = 4
+    min_latency = 0.5
+    rate_step = 5.0
+
+    def __init__(self,max_in_flight=10,max_rate=None):
+        self.max_in_flight = max_in_flight
+        self.max_rate = max_rate
+        self.window = float(max_in_flight)
+        self.rate = max_rate
+        self.in_flight = 0
+        self.signals = {}
+        self._lock = threading.Condition()
+        self._next_start = 0.0
+        self._starts = deque()
+        self._base = {}
+        self._last_decrease = 0.0
+        self._last_rate_decrease = 0.0
+        self._round_trip = 0.0
+
+    # wait for a free slot in the window and for the next start time if calls are paced
+    def acquire(self):
+        with self._lock:
+            while self.in_flight >= max(1, int(self.window)):
+                self._lock.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            delay = 0.0
+            if self.rate:
+                delay = max(0.0, self._next_start - now)
+                self._next_start = max(now, self._next_start) + 1 / self.rate
+            self._starts.append(now + delay)
+            while self._starts[0] < now - 2:
+                self._starts.popleft()
+        if delay:
+            time.sleep(delay)
+
+    # call done after latency seconds. signal: None or 'throttle', 'lock', 'error' (see above)
+    def release(self,command,latency,signal=None):
+        with self._lock:
+            self.in_flight -= 1
+            base = min(self._base.get(command, latency) * 1.001, latency)
+            self._base[command] = base
+            if signal is None and latency > max(self.min_latency, base * self.latency_factor):
+                signal = 'slow'
+            self._round_trip = latency if not self._round_trip else 0.8 * self._round_trip + 0.2 * latency
+            now = time.monotonic()
+            if signal:
+                self.signals[signal] = self.signals.get(signal, 0) + 1
+                if now - self._last_decrease > self._round_trip:
+                    self._last_decrease = now
+                    self.window = max(1.0, self.window * self.decrease)
+                if signal == 'throttle' and now - self._last_rate_decrease > max(1.0, self._round_trip):
+                    self._last_rate_decrease = now
+                    # calls per second started in the last two seconds
+                    started = len(self._starts) / 2
+                    self.rate = max(1.0, min(self.rate or started, started) * self.decrease)
+            else:
+                self.window = min(float(self.max_in_flight), self.window + 1 / self.window)
+                if self.rate:
+                    self.rate = min(self.rate + self.rate_step / self.rate, self.max_rate or float('inf'))
+            self._lock.notify_all()
+
+# api client holding a pooled keep-alive https session to one management server (or gateway,
+# use api='gaia_api'). every call reuses an already open tcp/tls connection instead of doing
+# a new handshake, which makes a huge difference when importing thousands of objects.
+# input:
+# - ip_addr   : ip address (or host name, optional :port) of check point management
+# - sid       : session id, if already logged in. set automatically by login()
+# - pool_size : max. number of parallel connections kept open
+# - retries   : number of retries if connecting to the server fails
+# - timeout   : connect and read timeout in seconds
+# - api       : 'web_api' (management) or 'gaia_api' (gaia os)
+# - adaptive  : congestion control (see Controller), calls the server pushes back are retried:
+#               idempotent ones (show-*, delete-*, publish...) up to throttle_retries times on throttle, lock,
+#               5xx and connection errors, all others only on throttle responses (the server did
+#               not run them). a repeated delete may find the object gone: generic_err_object_not_found
+class Client:
+    def __init__(self,ip_addr,sid='',pool_size=10,retries=3,timeout=(5,300),verify=False,api='web_api',adaptive=True,throttle_retries=5):
+        self.ip_addr = ip_addr
+        self.api = api
+        self.base_url = 'https://' + ip_addr + '/' + api + '/'
+        self.pool_size = pool_size
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        # passed with every request, session.verify would be overridden by REQUESTS_CA_BUNDLE
+        self.verify = verify
+        self.session.headers.update({'Content-Type' : 'application/json', 'Connection' : 'keep-alive'})
+        # retry connection errors only. api calls are posts and may not be idempotent (add-host...)
+        retry = Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=0.5)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self._executor = None
+        self._credentials = None
+        self._cache_file = None
+        self._login_lock = threading.Lock()
+        # changing calls made, and how many of them were published or discarded (see unpublished)
+        self._changes = 0
+        self._published = 0
+        self._changes_lock = threading.Lock()
+        # expired sid -> sid of the new login that replaced it (see _relogin and current_sid)
+        self._replaced = {}
+        self.sid = sid
+        # uid of the session (login response), e.g. to discard it from another session later
+        self.session_uid = ''
+        # latency statistics: command -> { 'count' : calls, 'items' : objects, 'seconds' : total }.
+        # 'task:<command>' entries are calls including the wait for their task, e.g.
+        # 'task:add-objects-batch:host' or 'task:publish'. see record() and merge_stats().
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self.controller = Controller(pool_size) if adaptive else None
+        self.throttle_retries = throttle_retries if adaptive else 0
+
+    # session id is sent as X-chkp-sid header with every request of this session
+    @property
+    def sid(self):
+        return self.session.headers.get('X-chkp-sid', '')
+
+    @sid.setter
+    def sid(self,sid):
+        if sid:
+            self.session.headers['X-chkp-sid'] = sid
+        else:
+            self.session.headers.pop('X-chkp-sid', None)
+
+    # api call. returns [status code, json data] like the call function below.
+    # the sid argument overrides the session id of the client for this one request.
+    # if the session expired, the client logs in again with the credentials of the last
+    # login and repeats the call once. not if it had unpublished changes: they are lost, so
+    # SessionExpired is raised. calls the server pushed back are retried (see adaptive).
+    def call(self,command,payload=None,sid=None):
+        idempotent = command.startswith(('show-', 'delete-')) or command in idempotent_commands
+        changing = sid is None and command.startswith(change_prefixes)
+        delays = backoff(0.2, max_delay=5)
+        for attempt in range(self.throttle_retries + 1):
+            try:
+                response = self._post(command, payload, sid)
+            except requests.RequestException:
+                if changing:
+                    # maybe made by the server anyway
+                    self._count_change()
+                if not idempotent or attempt == self.throttle_retries:
+                    raise
+                time.sleep(next(delays))
+                continue
+            if sid is None and self._credentials and command not in ('login', 'logout', 'keepalive') and _session_expired(response):
+                if self.unpublished():
+                    raise SessionExpired(command, response[0], dict(response[1], message='session expired with unpublished changes'))
+                if self._relogin(self.sid):
+                    response = self._post(command, payload, sid)
+            if changing and str(response[0]) == '200':
+                self._count_change()
+            elif sid is None and command == 'discard' and not (payload or {}).get('uid') and str(response[0]) == '200':
+                self._covered(self._changes)
+            signal = pushback(response)
+            if signal is None or not (idempotent or signal == 'throttle') or attempt == self.throttle_retries:
+                return response
+            time.sleep(next(delays))
+
+    # True if changes were made in the session (add-*, set-*, delete-* calls) that were not
+    # published or discarded yet
+    def unpublished(self):
+        with self._changes_lock:
+            return self._changes > self._published
+
+    def _count_change(self):
+        with self._changes_lock:
+            self._changes += 1
+
+    # the first changes (count) were published or discarded
+    def _covered(self,changes):
+        with self._changes_lock:
+            self._published = max(self._published, changes)
+
+    def _post(self,command,payload,sid):
+        headers = None
+        if sid is not None:
+            # a header set to None is removed from the request by requests
+            headers = {'X-chkp-sid' : sid or None}
+        if self.controller:
+            self.controller.acquire()
+        start = time.monotonic()
+        try:
+            req = self.session.post(self.base_url + command, data=json.dumps(payload or {}), headers=headers, timeout=self.timeout, verify=self.verify)
+        except requests.RequestException:
+            if self.controller:
+                self.controller.release(command, time.monotonic() - start, 'error')
+            raise
+        latency = time.monotonic() - start
+        self.record(command, latency)
+        try:
+            data = req.json()
+        except ValueError:
+            data = {'message' : req.text}
+        if self.controller:
+            self.controller.release(command, latency, pushback([req.status_code, data]))
+        return [req.status_code, data]
+
+    # pages through the results of any show-* command which supports limit and offset.
+    # follows from/to/total of the responses until everything is read. with prefetch, the
+    # next page is requested in the background while the caller works on the current one.
+    # yields the complete json data of every page.
+    def iter_pages(self,command,payload=None,limit=500,prefetch=True):
+        payload = dict(payload or {})
+        payload['limit'] = limit
+        offset = payload.get('offset', 0)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            page = pool.submit(self._page, command, payload, offset)
+            while page:
+                data = page.result()
+                page = None
+                last = data.get('to', 0)
+                # 'to' is the 1-based index of the last element, so it is the next offset
+                more = last > offset and last < data.get('total', 0)
+                if more and prefetch:
+                    page = pool.submit(self._page, command, payload, last)
+                yield data
+                if more and not prefetch:
+                    page = pool.submit(self._page, command, payload, last)
+                offset = last
+
+    # same as iter_pages, but yields the elements of the pages one by one. key is the
+    # list to take them from ('objects', 'rulebase'...). if not given, 'objects' or the
+    # first list in the response is taken.
+    def iter_items(self,command,payload=None,key=None,limit=500,prefetch=True):
+        for data in self.iter_pages(command, payload, limit, prefetch):
+            yield from data.get(key or _items_key(data), [])
+
+    # runs independent api calls concurrently. calls is a list of (command, payload) tuples,
+    # max_workers the max. number of requests in flight (keep it <= pool_size).
+    # output: list of [status, json data] in the same order as the calls. a call that failed
+    # without response (connection error, timeout) gets status 0 and the error as message.
+    def batch(self,calls,max_workers=8):
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(self._batch_call, calls))
+
+    # creates many objects of one type ('host', 'network', 'access-rule'...) with add-objects-batch,
+    # chunk_size objects per request. a batch is all or nothing: if a chunk fails, the task details
+    # (show-task, details-level full) tell which of its objects are wrong. the others are sent in
+    # a batch again, the wrong ones with single add-<type> calls to get their error. if the details
+    # don't tell, all objects of the chunk are sent with single calls. ordered=True does that in
+    # any case and one call after another, which is needed for rules added at position 'bottom'.
+    # chunk_size=0 skips the batch call and only does single calls.
+    # if it is not known whether a chunk was created (no response, task timeout or unknown), its
+    # items are not sent again (rule names are not unique, they would be there twice): they get
+    # status 0 and code 'batch_unknown'. fallback=False makes no more calls for a failed chunk
+    # (for callers doing that on their own): its items get status 400 and code 'batch_item_failed'
+    # (wrong, message from the task), 'batch_not_run' (not created because of the wrong ones) or
+    # 'batch_failed' (not known which ones are wrong).
+    # output: list of [status, json data] per item, in the order of items
+    def add_batch(self,obj_type,items,chunk_size=100,ordered=False,max_workers=8,timeout=None,fallback=True):
+        results = []
+        for start in range(0, len(items), chunk_size or len(items) or 1):
+            chunk = items[start:start + (chunk_size or len(items))]
+            single = list(range(len(chunk)))
+            if chunk_size:
+                chunk_results = self._add_chunk(obj_type, chunk, timeout)
+                codes = [result[1].get('code') for result in chunk_results]
+                if not fallback or 'batch_unknown' in codes or codes[0] is None:
+                    results.extend(chunk_results)
+                    continue
+                rest = [index for index, code in enumerate(codes) if code == 'batch_not_run']
+                if rest and not ordered:
+                    again = self.add_batch(obj_type, [chunk[index] for index in rest], chunk_size, ordered, max_workers, timeout)
+                    for index, result in zip(rest, again):
+                        chunk_results[index] = result
+                    single = [index for index, code in enumerate(codes) if code == 'batch_item_failed']
+            else:
+                chunk_results = [None] * len(chunk)
+            calls = [('add-' + obj_type, chunk[index]) for index in single]
+            if ordered:
+                responses = [self._batch_call(call) for call in calls]
+            else:
+                responses = self.batch(calls, max_workers)
+            for index, response in zip(single, responses):
+                chunk_results[index] = response
+            results.extend(chunk_results)
+        return results
+
+    # one add-objects-batch call, see add_batch. output: [status, json data] per item
+    def _add_chunk(self,obj_type,chunk,timeout):
+        start_time = time.monotonic()
+        payload = { 'objects' : [ { 'type' : obj_type, 'list' : chunk } ] }
+        response = self._batch_call(('add-objects-batch', payload))
+        status = 'no response: ' + response[1].get('message', '') if response[0] == 0 else None
+        details = []
+        if str(response[0]) == '200':
+            task = self.wait_for_task(response[1]['task-id'], timeout)
+            self.record('task:add-objects-batch:' + obj_type, time.monotonic() - start_time, len(chunk))
+            if task['status'] == 'succeeded':
+                return [[200, dict(item, type=obj_type)] for item in chunk]
+            if task['status'] != 'failed':
+                status = 'task ' + task['status']
+            else:
+                full = self._batch_call(('show-task', { 'task-id' : response[1]['task-id'], 'details-level' : 'full' }))
+                if str(full[0]) == '200':
+                    details = full[1]['tasks'][0].get('task-details', [])
+        if status:
+            error = { 'code' : 'batch_unknown', 'message' : 'add-objects-batch ' + status + ', maybe created' }
+            return [[0, error] for item in chunk]
+        wrong = { detail.get('name') : detail.get('message', '') for detail in details if detail.get('succeeded') is False }
+        names = [item.get('name') for item in chunk]
+        if not wrong or not set(wrong) <= set(names):
+            return [[400, { 'code' : 'batch_failed', 'message' : 'add-objects-batch failed' }] for item in chunk]
+        return [[400, { 'code' : 'batch_item_failed', 'message' : wrong[name] }] if name in wrong else
+                [400, { 'code' : 'batch_not_run', 'message' : 'add-objects-batch failed for other objects' }] for name in names]
+
+    # add a duration to the latency statistics (items: number of objects it was for)
+    def record(self,command,seconds,items=1):
+        with self._stats_lock:
+            entry = self.stats.setdefault(command, { 'count' : 0, 'items' : 0, 'seconds' : 0.0 })
+            entry['count'] += 1
+            entry['items'] += items
+            entry['seconds'] += seconds
+
+    def _batch_call(self,command_payload):
+        command, payload = command_payload
+        try:
+            return self.call(command, payload)
+        except requests.RequestException as error:
+            return [0, {'code' : 'client_error', 'message' : str(error)}]
+
+    def _page(self,command,payload,offset):
+        response = self.call(command, dict(payload, offset=offset))
+        if str(response[0]) != '200':
+            raise ApiError(command, response[0], response[1])
+        return response[1]
+
+    # login with api key read from auth_file (one line, only the key)
+    # with cache=True, the session is stored in session_cache_dir and reused by the next
+    # login as long as it is valid (see _resume). don't log out such sessions, use close().
+    # output: session id or error message
+    def login(self,auth_file,cache=False):
+        if not os.path.isfile(auth_file):
+            return 'Credentials file not found.'
+        with open(auth_file) as file:
+            token = file.readline().strip('\n')
+        if not token:
+            return 'Api key not found in auth file.'
+        return self._login({'api-key' : token}, cache)
+
+    # login with user and password for this host taken from a netrc file
+    # see https://everything.curl.dev/usingcurl/netrc for syntax. cache: see login
+    # output: session id or 'Login error'
+    def login_netrc(self,netrc_file,cache=False):
+        if not os.path.isfile(netrc_file):
+            return 'Credentials file not found.'
+        token = netrc.netrc(netrc_file).authenticators(self.ip_addr.split(':')[0])
+        if not token:
+            return 'Host not found in netrc file.'
+        return self._login({'user' : token[0], 'password' : token[2]}, cache)
+
+    def _login(self,payload,cache=False):
+        self._credentials = payload
+        self._cache_file = _cache_file(self.ip_addr, payload) if cache else None
+        if self._cache_file and self._resume():
+            return self.sid
+        response = self._post('login', payload, '')
+        if str(response[0]) == '200':
+            self.sid = response[1]['sid']
+            self.session_uid = response[1].get('uid', '')
+            if self._cache_file:
+                _write_cache(self._cache_file, self.sid, response[1].get('session-timeout', 600))
+            return self.sid
+        else:
+            print(json.dumps(response, indent=2))
+            return 'Login error'
+
+    # reuse the cached session if it did not expire yet. the keepalive call checks that the
+    # server still knows it and resets its timeout. a session with unpublished changes (left by
+    # a run that died) is not reused, the next publish would publish them. they are discarded,
+    # so their locks don't get in the way of the new session.
+    def _resume(self):
+        entry = _read_cache(self._cache_file)
+        if not entry or entry['expires'] <= time.time():
+            return False
+        response = self._post('keepalive', {}, entry['sid'])
+        if str(response[0]) != '200':
+            return False
+        response = self._post('show-session', {}, entry['sid'])
+        if str(response[0]) == '200' and not response[1].get('changes'):
+            self.sid = entry['sid']
+            _write_cache(self._cache_file, self.sid, entry['timeout'])
+            return True
+        self._post('discard', {}, entry['sid'])
+        self._post('logout', {}, entry['sid'])
+        return False
+
+    # new login after the session expired. the lock and the sid check make sure that
+    # parallel calls (batch, page prefetch) log in only once.
+    def _relogin(self,expired_sid):
+        with self._login_lock:
+            if self.sid != expired_sid:
+                return True
+            response = self._post('login', self._credentials, '')
+            if str(response[0]) != '200':
+                return False
+            self.sid = response[1]['sid']
+            self.session_uid = response[1].get('uid', '')
+            self._replaced[expired_sid] = self.sid
+            if self._cache_file:
+                _write_cache(self._cache_file, self.sid, response[1].get('session-timeout', 600))
+            return True
+
+    # sid that replaced the given one after (possibly several) re-logins. callers that keep the
+    # sid of their login (module level functions) would otherwise send the expired one again.
+    def current_sid(self,sid):
+        while sid in self._replaced:
+            sid = self._replaced[sid]
+        return sid
+
+    # another client for the same server with a session of its own, logged in with the credentials
+    # of the last login (e.g. to make changes in parallel sessions, see Writers).
+    # output: client or None if the login failed
+    def new_session(self):
+        other = Client(self.ip_addr, pool_size=self.pool_size, retries=self.retries, timeout=self.timeout, verify=self.verify,
+                       api=self.api, adaptive=self.controller is not None, throttle_retries=self.throttle_retries)
+        if not self._credentials or other._login(self._credentials) == 'Login error':
+            return None
+        return other
+
+    # logout and close all pooled connections. also removes the session from the cache.
+    def logout(self):
+        response = self.call('logout')
+        self.sid = ''
+        self.session.close()
+        if self._cache_file and os.path.isfile(self._cache_file):
+            os.remove(self._cache_file)
+        if str(response[0]) == '200':
+            return response[1]['message']
+        else:
+            return 'Logout error'
+
+    # close connections without logout. a cached session stays valid for the next run
+    # until its timeout, the keepalive time is stored in the cache. with unpublished changes,
+    # the session is removed from the cache (see _resume).
+    def close(self):
+        if self._cache_file and self.sid:
+            entry = _read_cache(self._cache_file)
+            if entry and entry['sid'] == self.sid and self.unpublished():
+                os.remove(self._cache_file)
+            elif entry and entry['sid'] == self.sid:
+                _write_cache(self._cache_file, self.sid, entry['timeout'])
+        self.session.close()
+
+    # polls show-task until the task is not 'in progress' any more. polling starts fast and
+    # slows down (see backoff below), so long running tasks do not hammer the server.
+    # input:
+    # - task_id  : returned by publish, install-policy, add-objects-batch...
+    # - timeout  : deadline in seconds, default publish_timeout
+    # - progress : optional function, called with the task data after every poll
+    # output: task data of the last show-task call. status is 'timeout' if the deadline
+    # was reached, 'unknown' if show-task failed.
+    def wait_for_task(self,task_id,timeout=None,progress=None):
+        end_time = time.monotonic() + (timeout or publish_timeout)
+        payload = { 'task-id' : task_id }
+        for delay in backoff():
+            response = self.call('show-task', payload)
+            if not str(response[0]) == '200':
+                return { 'task-id' : task_id, 'status' : 'unknown', 'message' : response[1].get('message', '') }
+            task = response[1]['tasks'][0]
+            if progress:
+                progress(task)
+            if task['status'] != 'in progress':
+                return task
+            if time.monotonic() + delay >= end_time:
+                return dict(task, status='timeout')
+            time.sleep(delay)
+
+    # publish changes and wait for the task to finish (see publish function below).
+    # with wait=False, the call returns at once with a future. future.result() returns
+    # the publish result, so the script can prepare the next batch in the meantime.
+    def publish(self,wait=True,timeout=None,progress=None):
+        if not wait:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            return self._executor.submit(self.publish, True, timeout, progress)
+        start_time = time.monotonic()
+        # changes made from here on may be too late for this publish
+        changes = self._changes
+        response = self.call('publish')
+        if str(response[0]) == '200':
+            status = self.wait_for_task(response[1]['task-id'], timeout, progress)['status']
+            self.record('task:publish', time.monotonic() - start_time)
+            if status == 'succeeded':
+                self._covered(changes)
+            return _publish_result(status)
+        else:
+            return 'Publish error'
+
+# asyncio version of the client for scripts and services running an event loop. the api
+# calls are coroutines and do not block the loop during the https round trip.
+# input: same as Client, plus
+# - connector : aiohttp connector to share one connection pool between several clients
+#               (e.g. one per management server), see shared_connector below
+class AsyncClient:
+    def __init__(self,ip_addr,sid='',pool_size=100,timeout=300,verify=False,api='web_api',connector=None):
+        if aiohttp is None:
+            raise ImportError('AsyncClient needs the aiohttp module (pip install aiohttp)')
+        self.ip_addr = ip_addr
+        self.base_url = 'https://' + ip_addr + '/' + api + '/'
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.verify = verify
+        self.connector = connector
+        self.session = None
+        self.sid = sid
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self,*exc):
+        await self.close()
+
+    # the aiohttp session has to be created inside the running event loop
+    def _session(self):
+        if self.session is None or self.session.closed:
+            connector = self.connector or shared_connector(self.pool_size, self.verify)
+            self.session = aiohttp.ClientSession(connector=connector, connector_owner=self.connector is None,
+                timeout=aiohttp.ClientTimeout(total=self.timeout), headers={'Content-Type' : 'application/json'})
+        return self.session
+
+    # api call, returns [status code, json data]. sid overrides the session id of the client.
+    async def call(self,command,payload=None,sid=None):
+        if sid is None:
+            sid = self.sid
+        headers = {'X-chkp-sid' : sid} if sid else {}
+        async with self._session().post(self.base_url + command, data=json.dumps(payload or {}), headers=headers) as req:
+            try:
+                data = await req.json(content_type=None)
+            except ValueError:
+                data = {'message' : await req.text()}
+            return [req.status, data]
+
+    # login with api key read from auth_file, see Client.login
+    async def login(self,auth_file):
+        if not os.path.isfile(auth_file):
+            return 'Credentials file not found.'
+        with open(auth_file) as file:
+            token = file.readline().strip('\n')
+        if not token:
+            return 'Api key not found in auth file.'
+        return await self._login({'api-key' : token})
+
+    # login with user and password from netrc file, see Client.login_netrc
+    async def login_netrc(self,netrc_file):
+        if not os.path.isfile(netrc_file):
+            return 'Credentials file not found.'
+        token = netrc.netrc(netrc_file).authenticators(self.ip_addr.split(':')[0])
+        if not token:
+            return 'Host not found in netrc file.'
+        return await self._login({'user' : token[0], 'password' : token[2]})
+
+    async def _login(self,payload):
+        response = await self.call('login', payload, sid='')
+        if str(response[0]) == '200':
+            self.sid = response[1]['sid']
+            return self.sid
+        else:
+            print(json.dumps(response, indent=2))
+            return 'Login error'
+
+    # logout and close the session (a shared connector stays open)
+    async def logout(self):
+        response = await self.call('logout')
+        self.sid = ''
+        await self.close()
+        if str(response[0]) == '200':
+            return response[1]['message']
+        else:
+            return 'Logout error'
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    # wait for a task without blocking the event loop, see Client.wait_for_task
+    async def wait_for_task(self,task_id,timeout=None,progress=None):
+        end_time = time.monotonic() + (timeout or publish_timeout)
+        payload = { 'task-id' : task_id }
+        for delay in backoff():
+            response = await self.call('show-task', payload)
+            if not str(response[0]) == '200':
+                return { 'task-id' : task_id, 'status' : 'unknown', 'message' : response[1].get('message', '') }
+            task = response[1]['tasks'][0]
+            if progress:
+                progress(task)
+            if task['status'] != 'in progress':
+                return task
+            if time.monotonic() + delay >= end_time:
+                return dict(task, status='timeout')
+            await asyncio.sleep(delay)
+
+    # publish changes and wait for the task. with wait=False, an asyncio task is returned
+    # which can be awaited later.
+    async def publish(self,wait=True,timeout=None,progress=None):
+        if not wait:
+            return asyncio.ensure_future(self.publish(True, timeout, progress))
+        response = await self.call('publish')
+        if str(response[0]) == '200':
+            status = (await self.wait_for_task(response[1]['task-id'], timeout, progress))['status']
+            return _publish_result(status)
+        else:
+            return 'Publish error'
+
+    # runs (command, payload) tuples concurrently, max_in_flight at a time. output is the
+    # same as Client.batch. it is a coroutine itself, so batches for several servers can
+    # run at once with asyncio.gather(client1.batch(...), client2.batch(...))
+    async def batch(self,calls,max_in_flight=50):
+        semaphore = asyncio.Semaphore(max_in_flight)
+        async def run(command,payload):
+            async with semaphore:
+                try:
+                    return await self.call(command, payload)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    return [0, {'code' : 'client_error', 'message' : str(error) or type(error).__name__}]
+        return await asyncio.gather(*(run(command, payload) for command, payload in calls))
+
+# connection pool for one or more AsyncClients. has to be created inside the event loop,
+# close it with 'await connector.close()' when all clients using it are done.
+def shared_connector(limit=100,verify=False):
+    return aiohttp.TCPConnector(limit=limit, ssl=None if verify else False)
+
+# local snapshot of hosts, networks, groups and tcp/udp services of the management database.
+# all objects are read once with a few paged show-* calls and indexed by name, by address
+# ('10.1.1.1/32', '10.1.0.0/16') and by protocol and port (('tcp', '443'), ('udp', '1000-2000')),
+# so existence checks and lookups are done locally without any api call.
+# keep it up to date with add() after creating objects or refresh() single object types.
+class Snapshot:
+    commands = {
+        'host' : 'show-hosts',
+        'network' : 'show-networks',
+        'group' : 'show-groups',
+        'service-tcp' : 'show-services-tcp',
+        'service-udp' : 'show-services-udp'
+    }
+
+    def __init__(self,api):
+        self.api = api
+        self.by_name = {}
+        self.by_address = {}
+        self.by_port = {}
+        self.types = set()
+
+    # read all objects of the given types (default: all of the above), one thread per type
+    def load(self,types=None):
+        types = types or list(self.commands)
+        with ThreadPoolExecutor(max_workers=len(types)) as pool:
+            for objects in pool.map(self._read, types):
+                for obj in objects:
+                    self.add(obj)
+        self.types.update(types)
+        return self
+
+    # write the snapshot to a json file, e.g. to plan changes later without api calls
+    def save(self,path):
+        with open(path + '.tmp', 'w') as file:
+            json.dump({ 'host' : getattr(self.api, 'ip_addr', ''), 'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'types' : sorted(self.types), 'objects' : list(self.by_name.values()) }, file)
+        os.replace(path + '.tmp', path)
+
+    # read a snapshot written by save(). returns host and time it was taken ({ 'host', 'time' }).
+    def read(self,path):
+        with open(path) as file:
+            saved = json.load(file)
+        for obj in saved['objects']:
+            self.add(obj)
+        self.types.update(saved['types'])
+        return { 'host' : saved.get('host', ''), 'time' : saved.get('time', '') }
+
+    # drop the objects of the given types and read them again
+    def refresh(self,types=None):
+        types = types or list(self.commands)
+        for name in [name for name, obj in self.by_name.items() if obj.get('type') in types]:
+            self.remove(name)
+        return self.load(types)
+
+    def _read(self,obj_type):
+        payload = { 'details-level' : 'standard' }
+        return [dict(obj, type=obj.get('type', obj_type)) for obj in self.api.iter_items(self.commands[obj_type], payload)]
+
+    # add object (as returned by show-* or add-* calls) to the indexes
+    def add(self,obj):
+        self.remove(obj['name'])
+        self.by_name[obj['name']] = obj
+        key = _address_key(obj)
+        if key:
+            self.by_address.setdefault(key, []).append(obj['name'])
+        key = _port_key(obj)
+        if key:
+            self.by_port.setdefault(key, []).append(obj['name'])
+
+    def remove(self,name):
+        obj = self.by_name.pop(name, None)
+        if obj is None:
+            return
+        for index, key in ((self.by_address, _address_key(obj)), (self.by_port, _port_key(obj))):
+            if key in index:
+                index[key].remove(name)
+                if not index[key]:
+                    del index[key]
+
+    # object with this name present? obj_type optionally restricts the check to one type
+    def exists(self,name,obj_type=None):
+        obj = self.by_name.get(name)
+        return obj is not None and (obj_type is None or obj.get('type') == obj_type)
+
+    def lookup_name(self,name):
+        return self.by_name.get(name)
+
+    # names of hosts (address/32) or networks with exactly this address and mask length
+    def lookup_address(self,address):
+        return self.by_address.get(address, [])
+
+    # names of tcp or udp services with exactly this port or port range
+    def lookup_port(self,protocol,port):
+        return self.by_port.get((protocol, str(port)), [])
+
+# runs changes (functions doing api calls) as soon as the changes they depend on are done, with
+# max_in_flight of them at a time, and publishes in between: after publish_every changes or
+# publish_interval seconds. for a publish, no new change is started and the running ones are
+# waited for, so a publish never overlaps a change of the same session. with a journal (see
+# Journal below), every successful publish marks the recorded changes of the session as published.
+# future.published (of every submitted change) is done after the first publish following the
+# change, succeeded or not (result: publish result), request_publish() publishes as soon as possible.
+# usage:
+#   pipeline = cpapi.Pipeline(client)
+#   hosts = pipeline.submit(client.add_batch, 'host', items, changes=len(items))
+#   pipeline.submit(add_rules, rules, depends=[hosts], changes=len(rules))
+#   results = pipeline.close()   # waits for everything, last publish, returns publish results
+class Pipeline:
+    def __init__(self,api,max_in_flight=8,publish_every=1000,publish_interval=300,publish_timeout=None,journal=None):
+        self.api = api
+        self.journal = journal
+        self.max_in_flight = max_in_flight
+        self.publish_every = publish_every
+        self.publish_interval = publish_interval
+        self.publish_timeout = publish_timeout
+        self.results = []
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight + 1)
+        self._lock = threading.Condition()
+        self._waiting = []
+        self._running = 0
+        self._unpublished = 0
+        self._covered = []
+        self._publishing = False
+        self._publish_requested = False
+        self._last_publish = time.monotonic()
+
+    # run function(*args) once all futures in depends are done (failed or not).
+    # changes: number of changes it makes, counted for publish_every. returns a future.
+    def submit(self,function,*args,depends=(),changes=1):
+        future = Future()
+        future.published = Future()
+        with self._lock:
+            self._waiting.append((future, function, args, [depend for depend in depends if depend is not None], changes))
+            self._dispatch()
+        return future
+
+    # block until at most pending changes are waiting or running (for producers reading big files)
+    def wait(self,pending=0):
+        with self._lock:
+            while len(self._waiting) + self._running + self._publishing > pending:
+                self._lock.wait(1)
+                self._dispatch()
+
+    # publish after the running changes, e.g. because another session needs one of them
+    def request_publish(self):
+        with self._lock:
+            self._publish_requested = True
+            self._dispatch()
+
+    # start what can be started, e.g. after a change depends on was done by another pipeline
+    def dispatch(self):
+        with self._lock:
+            self._dispatch()
+
+    # wait for all changes, publish the rest and stop. returns the results of all publishes.
+    def close(self):
+        self.wait()
+        if self._unpublished:
+            self._publish()
+        for published in self._covered:
+            published.set_result(None)
+        self._pool.shutdown()
+        return self.results
+
+    # start what can be started, or a publish if it is time for one. called with lock held.
+    def _dispatch(self):
+        if self._publishing:
+            return
+        if self._unpublished and (self._unpublished >= self.publish_every or time.monotonic() - self._last_publish >= self.publish_interval or self._publish_requested):
+            self._publishing = True
+            if not self._running:
+                self._pool.submit(self._publish)
+            return
+        waiting = []
+        for task in self._waiting:
+            if self._running < self.max_in_flight and all(depend.done() for depend in task[3]):
+                self._running += 1
+                self._pool.submit(self._run, task)
+            else:
+                waiting.append(task)
+        self._waiting = waiting
+
+    def _run(self,task):
+        future, function, args, depends, changes = task
+        try:
+            future.set_result(function(*args))
+        except Exception as error:
+            future.set_exception(error)
+        with self._lock:
+            self._running -= 1
+            self._unpublished += changes
+            self._covered.append(future.published)
+            if self._publishing and not self._running:
+                self._pool.submit(self._publish)
+            else:
+                self._dispatch()
+            self._lock.notify_all()
+
+    def _publish(self):
+        with self._lock:
+            covered = self._covered
+            self._covered = []
+            self._publish_requested = False
+        if self.journal is not None:
+            self.journal.publishing(self.api.session_uid)
+        try:
+            result = self.api.publish(timeout=self.publish_timeout)
+        except Exception as error:
+            result = 'Publish error: ' + str(error)
+        if self.journal is not None:
+            self.journal.published(result == 'Publish succeeded', self.api.session_uid)
+        for published in covered:
+            published.set_result(result)
+        with self._lock:
+            self.results.append(result)
+            self._unpublished = 0
+            self._last_publish = time.monotonic()
+            self._publishing = False
+            self._dispatch()
+            self._lock.notify_all()
+
+# raised by a change (see Writers) if objects it needed were locked by another session.
+# result: what the change did, rest: arguments to run the function with for what is left
+class Locked(Exception):
+    def __init__(self,result,*rest):
+        self.result = result
+        self.rest = rest
+        super().__init__('locked by another session')
+
+# changes made in several sessions side by side, each with a Pipeline and publishes of its own,
+# logged in with the credentials of api (see Client.new_session) when the first change goes to
+# them, so sessions without work never log in. the changes of a session that cannot log in are
+# made in the session of api (logins_failed counts them). with a journal, the uids of the sessions
+# logged in are kept in its info as 'sessions'. a change goes to the session of its key (crc32, e.g. object or layer name), so two
+# sessions never change the same object or layer. a change depending on a change made by another
+# session waits for that session to publish it (the other sessions do not see it before), and the
+# session is asked to do so at once. if the function raises Locked, the rest is repeated by the
+# next session lock_delay seconds (times the attempt) later, up to lock_retries times. the future
+# returned by submit then has the results of all attempts added up, or Locked at the end.
+# functions get the client of their session as first argument.
+# usage:
+#   writers = cpapi.Writers(client, sessions=4)
+#   hosts = writers.submit(name, add_hosts, items, changes=len(items))   # add_hosts(api, items)
+#   writers.submit(layer, add_rules, rules, depends=[hosts], changes=len(rules))
+#   results = writers.close()   # waits for everything, last publishes, logs out the extra sessions
+class Writers:
+    def __init__(self,api,sessions=4,max_in_flight=8,publish_every=1000,publish_interval=300,publish_timeout=None,journal=None,lock_retries=3,lock_delay=2):
+        self.api = api
+        self.max_in_flight = max_in_flight
+        self.publish_every = publish_every
+        self.publish_interval = publish_interval
+        self.publish_timeout = publish_timeout
+        self.journal = journal
+        # None: not logged in yet (see _open)
+        self.clients = [api] + [None] * (max(sessions, 1) - 1)
+        self.pipelines = [Pipeline(api, max_in_flight, publish_every, publish_interval, publish_timeout, journal)] + [None] * (len(self.clients) - 1)
+        self.logins_failed = 0
+        self.lock_retries = lock_retries
+        self.lock_delay = lock_delay
+        self._futures = []
+        self._open_lock = threading.Lock()
+        self._save_sessions()
+
+    # session (index of clients) changes with this key are made in
+    def session(self,key):
+        return zlib.crc32(str(key).encode()) % len(self.clients)
+
+    # like Pipeline.submit, in the session of key
+    def submit(self,key,function,*args,depends=(),changes=1):
+        future = Future()
+        future.parts = []
+        future.published = Future()
+        self._futures.append(future)
+        index = self.session(key)
+        self._open(index)
+        self._start(future, index, function, args, [self._ready(depend, index) for depend in depends if depend is not None], changes, 0, None)
+        return future
+
+    # block until at most pending changes are waiting or running in every session
+    def wait(self,pending=0):
+        for pipeline in self._opened():
+            pipeline.wait(pending)
+
+    # wait for all changes, publish the rest in every session and log out the extra sessions.
+    # returns the results of all publishes, session after session.
+    def close(self):
+        wait(self._futures)
+        pipelines = self._opened()
+        # last publishes side by side
+        for pipeline in pipelines:
+            pipeline.request_publish()
+        results = []
+        for pipeline in pipelines:
+            results.extend(pipeline.close())
+        for pipeline in pipelines[1:]:
+            pipeline.api.logout()
+        return results
+
+    # True if the last publish of every session that published succeeded
+    def published(self):
+        return all(pipeline.results[-1] == 'Publish succeeded' for pipeline in self._opened() if pipeline.results)
+
+    # latency statistics of all sessions (see Client.stats)
+    def stats(self):
+        stats = {}
+        for pipeline in self._opened():
+            stats = merge_stats(stats, pipeline.api.stats)
+        return stats
+
+    # log in session index if it is not yet. if the login fails, the session of api stands in.
+    def _open(self,index):
+        with self._open_lock:
+            if self.clients[index] is not None:
+                return
+            other = self.api.new_session()
+            if other is None:
+                self.logins_failed += 1
+                self.clients[index] = self.api
+                self.pipelines[index] = self.pipelines[0]
+                return
+            self.clients[index] = other
+            self.pipelines[index] = Pipeline(other, self.max_in_flight, self.publish_every, self.publish_interval, self.publish_timeout, self.journal)
+            self._save_sessions()
+
+    # pipelines of the sessions logged in, each once
+    def _opened(self):
+        pipelines = []
+        for pipeline in self.pipelines:
+            if pipeline is not None and pipeline not in pipelines:
+                pipelines.append(pipeline)
+        return pipelines
+
+    # uids of the sessions logged in, so a run that dies can discard them (even the ones whose
+    # changes did not get into the journal)
+    def _save_sessions(self):
+        if self.journal is not None:
+            self.journal.set('sessions', [pipeline.api.session_uid for pipeline in self._opened()])
+
+    # one attempt of a change in session index, parts: (session, pipeline future) of all attempts
+    def _start(self,future,index,function,args,depends,changes,attempt,result):
+        if attempt:
+            delay = self.lock_delay * attempt
+            task = self.pipelines[index].submit(_delayed, delay, function, self.clients[index], *args, depends=depends, changes=changes)
+        else:
+            task = self.pipelines[index].submit(function, self.clients[index], *args, depends=depends, changes=changes)
+        future.parts.append((index, task))
+        task.add_done_callback(lambda task: self._done(future, index, function, changes, attempt, result, task))
+
+    def _done(self,future,index,function,changes,attempt,result,task):
+        error = task.exception()
+        if isinstance(error, Locked):
+            result = error.result if result is None else result + error.result
+            if attempt < self.lock_retries:
+                self._open((index + 1) % len(self.clients))
+                self._start(future, (index + 1) % len(self.clients), function, error.rest, [], changes, attempt + 1, result)
+                return
+            error = Locked(result, *error.rest)
+        _when_all([part.published for session, part in future.parts], future.published)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(task.result() if result is None else result + task.result())
+
+    # future done as soon as the change of depend can be used in session index: when it is done,
+    # or when it is published if (part of) it was done by other sessions
+    def _ready(self,depend,index):
+        ready = Future()
+        def done(depend):
+            others = [(session, part) for session, part in getattr(depend, 'parts', []) if session != index]
+            _when_all([part.published for session, part in others], ready, self.pipelines[index].dispatch)
+            for session in { session for session, part in others if not part.published.done() }:
+                self.pipelines[session].request_publish()
+        depend.add_done_callback(done)
+        return ready
+
+# sets the result of target (None) once all futures are done, then calls then (if given)
+def _when_all(futures,target,then=None):
+    pending = [len(futures)]
+    lock = threading.Lock()
+    def finish():
+        target.set_result(None)
+        if then:
+            then()
+    def done(future):
+        with lock:
+            pending[0] -= 1
+            last = pending[0] == 0
+        if last:
+            finish()
+    if not futures:
+        finish()
+    for future in futures:
+        future.add_done_callback(done)
+
+# function(*args) after delay seconds
+def _delayed(delay,function,*args):
+    time.sleep(delay)
+    return function(*args)
+
+# append-only journal of api changes in a local sqlite database (wal mode, every change is
+# committed at once), so a script that dies halfway (session timeout, vpn drop) knows what it
+# did already, without asking the management server. a change is
+# - kind    : what was done, e.g. 'host', 'access-rule', 'delete-access-rule'
+# - key     : what it was done for, e.g. the name in the input file
+# - name    : check point name, uid: uid returned by the api (may be empty)
+# - data    : anything else the script needs to repeat its decisions (json)
+# - session : uid of the session that made the change (Client.session_uid)
+# changes are unpublished until published() is called after a publish (publishing() before it,
+# Pipeline does both). unpublished changes of a dead session are not in the database, resolve()
+# forgets them. if the script died during a publish, only the server knows if it worked, see
+# sessions(). info is a small key/value store, e.g. for the host the journal belongs to.
+class Journal:
+    def __init__(self,path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('pragma journal_mode=wal')
+        self._db.execute('pragma synchronous=normal')
+        self._db.execute('create table if not exists changes (id integer primary key autoincrement, kind text, key text, '
+                         'name text, uid text, data text, session text, published integer default 0)')
+        self._db.execute('create table if not exists info (key text primary key, value text)')
+
+    # record changes, one transaction for all of them. changes: list of dicts (see above)
+    def record(self,changes):
+        rows = [(change['kind'], change.get('key', ''), change.get('name', ''), change.get('uid', ''),
+                 json.dumps(change.get('data')), change.get('session', '')) for change in changes]
+        with self._lock, self._db:
+            self._db.executemany('insert into changes (kind, key, name, uid, data, session) values (?, ?, ?, ?, ?, ?)', rows)
+
+    # a publish starts, it covers all changes recorded so far (of one session, if given)
+    def publishing(self,session=None):
+        with self._lock, self._db:
+            self._db.execute('update changes set published = 2 where published = 0 and (? is null or session = ?)', (session, session))
+
+    # the publish is done, succeeded or not
+    def published(self,succeeded=True,session=None):
+        with self._lock, self._db:
+            self._db.execute('update changes set published = ? where published = 2 and (? is null or session = ?)', (1 if succeeded else 0, session, session))
+
+    # recorded changes in the order they were made (generator)
+    def changes(self,published=True):
+        with self._lock:
+            rows = self._db.execute('select kind, key, name, uid, data, session from changes where published = ? order by id', (int(published),)).fetchall()
+        for kind, key, name, uid, data, session in rows:
+            yield { 'kind' : kind, 'key' : key, 'name' : name, 'uid' : uid, 'data' : json.loads(data), 'session' : session }
+
+    # sessions with unpublished changes: { session uid : True if a publish of them was running }
+    def sessions(self):
+        with self._lock:
+            rows = self._db.execute('select session, max(published) from changes where published != 1 group by session').fetchall()
+        return { session : publishing == 2 for session, publishing in rows }
+
+    # unpublished changes of a session, with their row id (see confirm)
+    def pending(self,session):
+        with self._lock:
+            rows = self._db.execute('select id, kind, key, name, uid from changes where published != 1 and session = ? order by id', (session,)).fetchall()
+        return [{ 'id' : id, 'kind' : kind, 'key' : key, 'name' : name, 'uid' : uid } for id, kind, key, name, uid in rows]
+
+    # changes (row ids) that turned out to be published, e.g. found in the management
+    def confirm(self,ids):
+        with self._lock, self._db:
+            self._db.executemany('update changes set published = 1 where id = ?', [(id,) for id in ids])
+
+    # unpublished changes of a session: forget them, or keep them if the publish that was
+    # running worked after all (published=True)
+    def resolve(self,session,published=False):
+        with self._lock, self._db:
+            if published:
+                self._db.execute('update changes set published = 1 where published != 1 and session = ?', (session,))
+            else:
+                self._db.execute('delete from changes where published != 1 and session = ?', (session,))
+
+    def get(self,key,default=None):
+        with self._lock:
+            row = self._db.execute('select value from info where key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self,key,value):
+        with self._lock, self._db:
+            self._db.execute('insert or replace into info (key, value) values (?, ?)', (key, json.dumps(value)))
+
+    # forget everything, e.g. after the work is done and saved elsewhere
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute('delete from changes')
+            self._db.execute('delete from info')
+
+    def close(self):
+        self._db.close()
+
+# add latency statistics (Client.stats) to the ones of earlier runs, e.g. read from a json file
+def merge_stats(stats,more):
+    merged = { command : dict(entry) for command, entry in stats.items() }
+    for command, entry in more.items():
+        total = merged.setdefault(command, { 'count' : 0, 'items' : 0, 'seconds' : 0.0 })
+        for key in ('count', 'items', 'seconds'):
+            total[key] += entry[key]
+    return merged
+
+# objects are indexed from show-* output (ipv4-address, subnet4...) or add-* payloads (ip-address, subnet...)
+def _address_key(obj):
+    if obj.get('type') == 'host' and obj.get('ipv4-address', obj.get('ip-address')):
+        return obj.get('ipv4-address', obj.get('ip-address')) + '/32'
+    if obj.get('type') == 'network' and obj.get('subnet4', obj.get('subnet')):
+        return obj.get('subnet4', obj.get('subnet')) + '/' + str(obj.get('mask-length4', obj.get('mask-length')))
+    return None
+
+def _port_key(obj):
+    if obj.get('type') in ('service-tcp', 'service-udp') and obj.get('port'):
+        return (obj['type'][8:], str(obj['port']))
+    return None
+
+# session cache: one file per management server and credential, readable for the owner only.
+# it holds the sid and the time it expires, which is renewed by every keepalive/close.
+session_cache_dir = os.path.expanduser('~/.cache/cpapi')
+
+def _cache_file(ip_addr,credentials):
+    identity = hashlib.sha256(json.dumps(credentials, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(session_cache_dir, ip_addr.replace(':', '_') + '-' + identity + '.json')
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _write_cache(cache_file,sid,timeout):
+    os.makedirs(os.path.dirname(cache_file), mode=0o700, exist_ok=True)
+    # a little less than the server timeout, so a session is not used in its last seconds
+    entry = { 'sid' : sid, 'timeout' : timeout, 'expires' : time.time() + timeout - 30 }
+    handle = os.open(cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(handle, 'w') as file:
+        json.dump(entry, file)
+
+# commands besides show-* and delete-* that can be repeated without harm (see Client),
+# a repeated publish has nothing left to publish
+idempotent_commands = ('keepalive', 'where-used', 'publish')
+
+# commands making changes in the session, which are lost if it expires before a publish
+change_prefixes = ('add-', 'set-', 'delete-')
+
+# how the server pushed back on a call: 'throttle' (too many requests, server busy - the call
+# was not run), 'lock' (object locked by another session), 'error' (other 5xx) or None
+def pushback(response):
+    status = response[0]
+    code = str(response[1].get('code', ''))
+    message = str(response[1].get('message', '')).lower()
+    if status == 429 or 'too_many_requests' in code or 'busy' in code or 'busy' in message or 'too many requests' in message:
+        return 'throttle'
+    if 'lock' in code or 'locked' in message:
+        return 'lock'
+    if isinstance(status, int) and status >= 500:
+        return 'error'
+    return None
+
+# response of a call done with an expired or unknown session id
+def _session_expired(response):
+    if response[0] == 401:
+        return True
+    return response[1].get('code') in ('generic_err_wrong_session_id', 'generic_err_session_expired', 'generic_err_invalid_session')
+
+# delays between two polls of a running task: starts with initial seconds, grows by factor
+# up to max_delay. jitter randomizes every delay by +/- that fraction, so several scripts
+# waiting at the same time do not poll in lockstep.
+def backoff(initial=0.2,factor=2,max_delay=5,jitter=0.2):
+    delay = initial
+    while True:
+        yield delay * random.uniform(1 - jitter, 1 + jitter)
+        delay = min(delay * factor, max_delay)
+
+# publish result strings as returned by the publish function
+def _publish_result(status):
+    if status == 'succeeded':
+        return 'Publish succeeded'
+    elif status == 'timeout':
+        return 'Publish timeout'
+    else:
+        print('Publish error:')
+        return status
+
+# find the list holding the elements of a show-* response
+def _items_key(data):
+    if 'objects' in data:
+        return 'objects'
+    for key, value in data.items():
+        if isinstance(value, list) and key != 'objects-dictionary':
+            return key
+    return 'objects'
+
+# the module level functions below are kept for existing scripts. they share one pooled
+# client per management server, so consecutive calls reuse the same connection.
+_clients = {}
+def client(ip_addr):
+    if ip_addr not in _clients:
+        _clients[ip_addr] = Client(ip_addr)
+    return _clients[ip_addr]
+
 # api login function. input:
-# - auth_file : netrc file with credentials for management
+# - auth_file : file with api key for management
 # - ip_addr   : ip address of check point management
+# - cache     : reuse the session of the last run if still valid (see Client.login)
 # output: session id
-def login(ip_addr,auth_file):
-    # check credentials file
-    exists = os.path.isfile(auth_file)
-    if not exists:
-        return 'Credentials file not found.'
-    # get api key from file
-    with open(auth_file) as file:
-        token = file.readline().strip('\n')
-    if token:
-        payload = {'api-key' : token}
-    else:
-        return 'Api key not found in auth file.'
-    # do login and return sid
-    request_headers = {'Content-Type' : 'application/json'}
-    url = 'https://' + ip_addr + '/web_api/login'
-    req = requests.post(url,data=json.dumps(payload),headers=request_headers,verify=False)
-    response = [req.status_code, req.json()]
-    if str(response[0]) == '200':
-        return response[1]["sid"]
-    else:
-        print(json.dumps(response, indent=2))
+def login(ip_addr,auth_file,cache=False):
+    sid = client(ip_addr).login(auth_file, cache)
+    if sid == 'Login error':
         return 'Login error.'
+    return sid
 
 # api logout
 def logout(ip_addr,sid):
-    url = 'https://' + ip_addr + '/web_api/logout'
-    payload = {}
-    request_headers = {'Content-Type' : 'application/json', 'X-chkp-sid' : sid}
-    req = requests.post(url,data=json.dumps(payload),headers=request_headers,verify=False)
-    response = [req.status_code, req.json()]
+    api = client(ip_addr)
+    response = api.call('logout', {}, api.current_sid(sid))
     if str(response[0]) == '200':
         return response[1]['message']
     else:
         return 'Logout error'
 
+# close connections but keep the (cached) session for the next run
+def close(ip_addr):
+    client(ip_addr).close()
+
 # the 'publish' api call returns a task id which is monitored until the 'show-task'
-# call returns anything other than 'in progress'. the publish timeout makes sure
-# the function returns even if it gets stuck somewhere.
+# call returns anything other than 'in progress' (see Client.wait_for_task). the publish
+# timeout makes sure the function returns even if it gets stuck somewhere.
 # input:
 # - ip_addr : ip address (or host name) of check point management server
 # - sid : the session identifier generated by the login call
@@ -56,30 +1299,11 @@ def logout(ip_addr,sid):
 # - 'Publish succeeded' if successful, any other, if not.
 publish_timeout = 120
 def publish(ip_addr,sid):
-    url = 'https://' + ip_addr + '/web_api/publish'
-    payload = {}
-    request_headers = {'Content-Type' : 'application/json', 'X-chkp-sid' : sid}
-    req = requests.post(url,data=json.dumps(payload),headers=request_headers,verify=False)
-    response = [req.status_code, req.json()]
-    if str(response[0]) == '200':
-        task_id = response[1]['task-id']
-        url = 'https://' + ip_addr + '/web_api/show-task'
-        payload = { 'task-id' : task_id }
-        status = 'in progress'
-        end_time = datetime.datetime.now() + datetime.timedelta(seconds=publish_timeout)
-        while status == 'in progress':
-            if datetime.datetime.now() >= end_time:
-                return 'Publish timeout'
-            req = requests.post(url,data=json.dumps(payload),headers=request_headers,verify=False)
-            response = [req.status_code, req.json()]
-            status = response[1]['tasks'][0]['status']
-        if status == 'succeeded':
-            return 'Publish succeeded'
-        else:
-            print('Publish error:')
-            return status
-    else:
-        return 'Publish error'
+    api = client(ip_addr)
+    sid = api.current_sid(sid)
+    if api.sid != sid:
+        api.sid = sid
+    return api.publish()
 
 # check point api call. for payload/command syntax see
 # https://sc1.checkpoint.com/documents/latest/APIs/index.html#introduction~v1.9.1%20
@@ -90,8 +1314,40 @@ def publish(ip_addr,sid):
 # output:
 # depends... ;)
 def call(ip_addr,command,payload,sid):
-    url = 'https://' + ip_addr + '/web_api/' + command
-    request_headers = {'Content-Type' : 'application/json', 'X-chkp-sid' : sid}
-    response = requests.post(url,data=json.dumps(payload), headers=request_headers, verify = False)
-    status = response.status_code
-    return [status, response.json()]
+    api = client(ip_addr)
+    sid = api.current_sid(sid)
+    # own session: let the client handle session expiry
+    if sid == api.sid:
+        sid = None
+    return api.call(command, payload, sid)
+
+# page iterators, see Client.iter_pages and Client.iter_items
+def iter_pages(ip_addr,command,payload,sid,limit=500):
+    api = client(ip_addr)
+    sid = api.current_sid(sid)
+    if api.sid != sid:
+        api.sid = sid
+    return api.iter_pages(command, payload, limit)
+
+def iter_items(ip_addr,command,payload,sid,key=None,limit=500):
+    api = client(ip_addr)
+    sid = api.current_sid(sid)
+    if api.sid != sid:
+        api.sid = sid
+    return api.iter_items(command, payload, key, limit)
+
+# concurrent api calls, see Client.batch
+def batch(ip_addr,calls,sid,max_workers=8):
+    api = client(ip_addr)
+    sid = api.current_sid(sid)
+    if api.sid != sid:
+        api.sid = sid
+    return api.batch(calls, max_workers)
+
+# bulk object creation, see Client.add_batch
+def add_batch(ip_addr,obj_type,items,sid,chunk_size=100,ordered=False):
+    api = client(ip_addr)
+    sid = api.current_sid(sid)
+    if api.sid != sid:
+        api.sid = sid
+    return api.add_batch(obj_type, items, chunk_size, ordered)
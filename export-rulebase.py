@@ -6,11 +6,8 @@
 # dj0Nz feb 2024
 
 # modules needed
-import os, requests, json, netrc, re, sys, socket
-
-# next two lines needed to suppress warnings if self signed certificates are used
-from urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+import os, json, re, sys, socket, textwrap
+import cpapi
 
 # check point management server
 host = '192.168.1.11'
@@ -28,6 +25,9 @@ if not exists:
 
 # check if port open
 def port_open(ip,port):
+    # host may be given as address:port, e.g. for a local test server (mock-mgmt.py)
+    if ':' in ip:
+        ip, port = ip.rsplit(':', 1)
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
         sock.settimeout(1)
@@ -36,73 +36,63 @@ def port_open(ip,port):
     except:
         return False
 
-# api_call function
-# do web_api call and return json structure to work on
-def api_call(ip_addr, command, json_payload, sid):
-    url = 'https://' + ip_addr + '/web_api/' + command
-    if sid == '':
-        request_headers = {'Content-Type' : 'application/json'}
-    else:
-        request_headers = {'Content-Type' : 'application/json', 'X-chkp-sid' : sid}
-    r = requests.post(url,data=json.dumps(json_payload), headers=request_headers, verify = False)
-    status_code = r.status_code
-    return [status_code, r.json()]
-
-# login function.
-# read netrc file and extract credentials for host if any
-# then do login and return sid or login error
-def api_login(ip_addr):
-    # get login credentials from .netrc file
-    auth = netrc.netrc(auth_file)
-    token = auth.authenticators(host)
-    if token:
-        user = token[0]
-        password = token[2]
-    else:
-        quit('Host not found in netrc file.')
-    # do login
-    payload = {'user':user, 'password' : password}
-    response = api_call(ip_addr,'login',payload,'')
-    if str(response[0]) == '200':
-        return response[1]["sid"]
-    else:
-        return 'Login error'
-
 ##################
 ### main section
 ##################
 
 # get session id needed to authorize api call
 if port_open(host,443):
-    sid = api_login(host)
+    client = cpapi.Client(host)
+    sid = client.login_netrc(auth_file, cache=True)
+    if sid == 'Host not found in netrc file.':
+        quit(sid)
     if sid == 'Login error':
         quit('Login error.')
 else:
     quit('Management unrechable.')
 
-# define payload data for the api call
+# define payload data for the api call. limit and offset are handled by cpapi, the
+# rulebase is read page by page, so there is no size limit any more
 payload = {
-  "offset" : 0,
-  "limit" : 500,
   "name" : export_rulebase,
   "details-level" : "standard",
   "use-object-dictionary" : "true"
 }
 
-# finally, get policy and write it to file
-response = api_call(host, 'show-access-rulebase', payload, sid)
-if str(response[0]) == '200':
-    rulebase = json.dumps(response[1], indent=2)
-    with open(output_file, 'w') as file:
-        file.write(rulebase)
+# finally, get policy and write it to file. rules are written as soon as a page arrives,
+# the object dictionary (uid -> object) is collected from all pages and written at the end.
+# the file is written under a temporary name and renamed when complete, so an error halfway
+# does not leave a truncated file (or destroy the one of the last run).
+dictionary = {}
+try:
+    with open(output_file + '.tmp', 'w') as file:
+        file.write('{\n  "name": ' + json.dumps(export_rulebase) + ',\n  "rulebase": [')
+        count = 0
+        total = 0
+        for page in client.iter_pages('show-access-rulebase', payload):
+            for rule in page.get('rulebase', []):
+                if count:
+                    file.write(',')
+                file.write('\n' + textwrap.indent(json.dumps(rule, indent=2), '    '))
+                count += 1
+            total = page.get('total', 0)
+            for obj in page.get('objects-dictionary', []):
+                dictionary[obj['uid']] = obj
+        file.write('\n  ],\n  "objects-dictionary": ')
+        file.write(textwrap.indent(json.dumps(list(dictionary.values()), indent=2), '  ').lstrip())
+        file.write(',\n  "total": ' + str(count) + '\n}\n')
+    os.replace(output_file + '.tmp', output_file)
+    # rules added or deleted while reading shift the pages
+    if count != total:
+        print('Rulebase changed during export: ' + str(count) + ' entries written, ' + str(total) + ' in rulebase.')
+except cpapi.ApiError as error:
+    os.remove(output_file + '.tmp')
+    print('Unknown response:')
+    print(json.dumps(error.data, indent=2))
 
 ##################
 ### end main section
 ##################
 
-# be nice and log out
-logout_result = api_call(host, "logout",{},sid)
-logout_message = logout_result[1]['message']
-if logout_message != 'OK':
-    print('Logout unsuccessful.')
-~
+# no logout: the session is cached and reused by the next run (see cpapi.Client.login)
+client.close()
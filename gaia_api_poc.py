@@ -24,35 +24,24 @@
 #
 # dj0Nz apr 2023
 
-import os, requests, json, netrc
-
-# next two lines needed to suppress warnings if self signed certificates are used
-from urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
-
-# modified api_call function. typos and hardcoded stuff removed
-def api_call(ip_addr, command, json_payload, sid):
-    url = 'https://' + ip_addr + '/gaia_api/' + command
-    if sid == '':
-        request_headers = {'Content-Type' : 'application/json'}
-    else:
-        request_headers = {'Content-Type' : 'application/json', 'X-chkp-sid' : sid}
-    r = requests.post(url,data=json.dumps(json_payload), headers=request_headers, verify = False)
-    status_code = r.status_code
-    return [status_code, r.json()]
+import os, netrc
+import cpapi
 
+# api calls go through a pooled cpapi client using the gaia_api endpoint (see below)
 # login function. self explaining.
 def api_login(ip_addr,user,password):
     payload = {'user':user, 'password' : password}
-    response = api_call(host,'login',payload,'')
+    response = client.call('login',payload,'')
     if str(response[0]) == '200':
-        return response[1]["sid"]
+        client.sid = response[1]["sid"]
+        return client.sid
     else:
         return 'Login error'
 
 # check point gateway and route to query 
 host = '192.168.1.2'
 route = '192.168.100.0/24'
+client = cpapi.Client(host, api='gaia_api')
 
 # check credentials file
 auth_file = '.netrc'
@@ -75,7 +64,7 @@ if sid == 'Login error':
     quit('Login error. Exiting.')
 
 # request routing table with api
-get_route_result = api_call(host, 'show-routes-static', {}, sid)
+get_route_result = client.call('show-routes-static', {})
 
 # check web server response
 if str(get_route_result[0]) == '200':
@@ -105,7 +94,6 @@ else:
     print(f'dst {route} routed via default gateway {def_gw} dev {def_if}')
 
 # be nice and log out
-logout_result = api_call(host, "logout",{},sid)
-logout_message = logout_result[1]['message']
+logout_message = client.logout()
 if logout_message != 'OK':
     print('Logout unsuccessful.')
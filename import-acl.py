@@ -2,13 +2,17 @@
 
 # Import Cisco acls and objects exported with parse-acl.py to Check Point database
 # dj0Nz mar 2024
+#
+# Usage:
+# ./import-acl.py          (import)
+# ./import-acl.py --plan   (only show what an import would do and how long it takes)
+# ./import-acl.py --sessions 1   (make all changes in one session)
+# ./import-acl.py --acl EDGE     (import acl EDGE of a rules file with several acls)
 
 # Modules needed to query mgmt api, parse input and format output 
-import ast, os, requests, json, netrc, re, sys, socket, time
-
-# Next two lines needed to suppress warnings if self signed certificates are used
-from urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+import argparse, bisect, math, os, json, re, sys, socket, zlib
+from concurrent.futures import Future
+import aclformat, cpapi
 
 ##########
 # Variables
@@ -19,32 +23,34 @@ host = '192.168.1.11'
 # See https://everything.curl.dev/usingcurl/netrc for syntax and other information
 auth_file = '/home/api/api/.netrc'
 
-# Check credentials file, quit if not there
-exists = os.path.isfile(auth_file)
-if not exists:
-    quit('Credentials file not found. Exiting.')
-
 # Input files:
-# - netobjects.txt holds network objects exported with parse-acl.py
-# - rules.txt has the Cisco ACLs
+# - netobjects.jsonl holds network objects exported with parse-acl.py
+# - rules.jsonl has the Cisco ACLs
+#   (both json lines, see aclformat.py, gzip compressed ones with .gz are found too)
 # - services.json is manually created and has a kind of conversion table i
 #   between Cisco and Check Point service names. Self-Explaining. ;)
-objects_in = 'netobjects.txt'
-rules_in = 'rules.txt'
+#   Optional: tcp/udp ports not in there are looked up in the existing services by port or
+#   range, missing services are created (named like tcp_443 or udp_1000-2000).
+objects_in = 'netobjects.jsonl'
+rules_in = 'rules.jsonl'
 service_replace = 'services.json'
 
 # Lists for network objects and rules
-# - service_table: List object for the service conversion table
-# - net2cp_table:  Cisco to Check Point object conversion table. Because you don't use names 
-#                  in Cisco ACLs, a Check Point object gets created from IP and subnet mask
-# - netobjects_in: List temporarily needed for object creation 
+# - service_table: Service conversion table (Cisco name or port -> Check Point service name)
+# - service_cache: (protocol, port or range) -> check point service name
+# - net2cp_table:  Cisco to Check Point object conversion table (acl object -> check point name).
+#                  Because you don't use names in Cisco ACLs, a Check Point object gets created
+#                  from IP and subnet mask
 # - netobjects:    List that finally holds host and network objects
-# - rules:         Thats (surprise, surprise) the rules list
-service_table = []
-net2cp_table = []
-netobjects_in = []
+# - unread_rules, unread_objects: state entries of rules and objects (check point name -> type)
+#                  created by batch calls of this run or an interrupted one, their uids are read
+#                  at the end
+service_table = {}
+service_cache = {}
+net2cp_table = {}
 netobjects = []
-rules = []
+unread_rules = []
+unread_objects = {}
 
 # Shared layer for migrated rules
 # The idea behind is, to create all rules in a separate but shared layer in order to prevent 
@@ -52,6 +58,43 @@ rules = []
 # but mostly, there are no more than 200-300 ACLs if any.
 layer_name = 'Core'
 
+# Max. number of concurrent api requests (or batch calls) when creating objects and rules, per session
+max_in_flight = 8
+
+# Number of sessions making changes side by side, each publishing its own (see cpapi.Writers).
+# Objects and services are spread over the sessions by name, all rules of the layer are made by one.
+# Rules wait until the sessions that created their objects published them.
+write_sessions = 4
+
+# Changes are published every publish_every changes or publish_interval seconds,
+# so a long import does not keep all its locks until the end
+publish_every = 1000
+publish_interval = 300
+
+# Number of objects or rules per add-objects-batch call. If a batch fails, the items the server
+# names as wrong are left out and the rest is sent again (see cpapi.Client.add_batch).
+# 0 = no batch calls, only single add-host/add-access-rule calls.
+batch_size = 100
+
+# State of the last import: check point names and uids of the objects and rules created from the
+# objects and rules files. A rerun only creates new objects and rules and deletes the rules that
+# are not in the rules file any more. Delete the file for a full import.
+state_file = 'import-state.json'
+
+# Journal of the changes made by a running import (sqlite, see cpapi.Journal). If the import
+# dies halfway (session timeout, vpn drop), the next run takes the published changes from there
+# and continues after them. Unpublished ones are discarded. Emptied when the state file is saved.
+journal_file = 'import-journal.db'
+
+# --plan: nothing is changed and no api call is made. The planned changes go to plan_file, the
+# objects of the management database are taken from snapshot_file (written by every import that
+# reads them) and the expected time is calculated from the latency statistics of earlier imports
+# in stats_file (calls without statistics are assumed to take default_latency seconds).
+plan_file = 'import-plan.txt'
+snapshot_file = 'mgmt-snapshot.json'
+stats_file = 'import-stats.json'
+default_latency = 1.0
+
 # Comment for every newly created object, also for firewall rules and layers
 comments = 'Migrated from Cisco ACL'
 
@@ -61,8 +104,258 @@ comments = 'Migrated from Cisco ACL'
 ##########
 # Functions
 
+# Check Point object name for a network object from the objects file ('address/prefix length'):
+# 'host_<ipaddress>' or 'net_<subnet address>_<mask length>'
+def cp_object_name(netobject):
+    object_addr, object_mask = netobject.split('/')
+    if object_mask == '32':
+        return('host' + '_' + object_addr)
+    return('net' + '_' + object_addr + '_' + object_mask)
+
+# Input file name, the gzip compressed one if only that exists
+def input_file(name):
+    if not os.path.isfile(name) and os.path.isfile(name + '.gz'):
+        return(name + '.gz')
+    return(name)
+
+# Read state of the last import to the same host and layer (empty state if there is none)
+def load_state(path):
+    state = { 'host' : host, 'layer' : layer_name, 'layer-created' : False, 'objects' : {}, 'services' : {}, 'rules' : [] }
+    if os.path.isfile(path):
+        with open(path) as file:
+            saved = json.load(file)
+        if saved.get('host') == host and saved.get('layer') == layer_name:
+            state.update(saved)
+        else:
+            print('State file ' + path + ' is for another host or layer, ignored.')
+    return(state)
+
+# Write state (or statistics), a crash while writing does not destroy the old one
+def save_json(path,data):
+    with open(path + '.tmp', 'w') as file:
+        json.dump(data, file, indent=1)
+    os.replace(path + '.tmp', path)
+
+# Add published changes of an interrupted import (see journal_file) to the state, as if the
+# import had finished after them. Created rules go where they were created (top, bottom or
+# below another rule), so the rule order is the one in the layer. Running it twice is harmless.
+# A deleted rule is found by uid, there may be a stale one with the same key (see merge_stale_rules).
+def replay_journal(state,changes):
+    count = 0
+    rules = state['rules']
+    keys = { entry['key'] for entry in rules if not entry.get('stale') }
+    last = -1
+    for change in changes:
+        count += 1
+        if change['kind'] in ('host', 'network', 'group'):
+            state['objects'][change['key']] = { 'name' : change['name'], 'uid' : change['uid'] }
+            if not change['uid']:
+                unread_objects[change['name']] = change['kind']
+        elif change['kind'] in ('service-tcp', 'service-udp'):
+            state['services'][change['key']] = change['name']
+        elif change['kind'] == 'access-layer':
+            state['layer-created'] = True
+        elif change['kind'] == 'delete-access-rule':
+            deleted = [entry for entry in rules if entry['key'] == change['key'] and change['uid'] in (entry['uid'], '')]
+            for entry in deleted:
+                rules.remove(entry)
+                if not entry.get('stale'):
+                    keys.discard(entry['key'])
+            last = -1
+        elif change['kind'] == 'access-rule' and change['key'] not in keys:
+            keys.add(change['key'])
+            entry = { 'key' : change['key'], 'uid' : change['uid'] }
+            if not change['uid']:
+                unread_rules.append(entry)
+            position = change['data']
+            if position == 'top':
+                last = 0
+            elif isinstance(position, dict):
+                # mostly right below the rule created before
+                anchor = position['below']
+                if not (0 <= last < len(rules) and anchor in (rules[last]['key'], rules[last]['uid'])):
+                    last = next((index for index, rule in enumerate(rules) if anchor in (rule['key'], rule['uid'])), len(rules) - 1)
+                last += 1
+            else:
+                last = len(rules)
+            rules.insert(last, entry)
+    return(count)
+
+# Rules of the acl to import (--acl), all rules if no acl is given
+def acl_rules(records):
+    for line_number, rule in records:
+        if not args.acl or rule.get('acl') == args.acl:
+            yield line_number, rule
+
+# Rules with their content key: hash of the record (see aclformat.record_hash), numbered if
+# the same rule is there more than once. Yields (line number, rule, key).
+def keyed_rules(records):
+    counts = {}
+    for line_number, rule in records:
+        key = aclformat.record_hash(rule)
+        counts[key] = counts.get(key, 0) + 1
+        if counts[key] > 1:
+            key += '-' + str(counts[key])
+        yield line_number, rule, key
+
+# Rules of the last import that can stay where they are: the longest sequence of known rules
+# that is in the same order in the rules file (longest increasing subsequence of their old
+# positions). All others are deleted and created again at their new position.
+# known_rules: key -> (old position, state entry). Returns set of keys.
+def unchanged_rules(keys,known_rules):
+    positions = [known_rules[key][0] for key in keys if key in known_rules]
+    tails = []
+    tail_index = []
+    previous = [-1] * len(positions)
+    for index, position in enumerate(positions):
+        length = bisect.bisect_left(tails, position)
+        if length == len(tails):
+            tails.append(position)
+            tail_index.append(index)
+        else:
+            tails[length] = position
+            tail_index[length] = index
+        previous[index] = tail_index[length - 1] if length > 0 else -1
+    kept = set()
+    index = tail_index[-1] if tail_index else -1
+    while index >= 0:
+        kept.add(positions[index])
+        index = previous[index]
+    return({ key for key, (position, entry) in known_rules.items() if position in kept })
+
+# Rules that could not be deleted are still in the layer, at their old position: before the
+# next rule of the last import that stayed (rules created since then are above them). They are
+# marked stale, so the next import deletes them in any case, also if a rule with the same key
+# was created again (moved rule). old_rules: rules of the last import, in rulebase order.
+def merge_stale_rules(rules,stale,old_rules):
+    old_index = { id(entry) : index for index, entry in enumerate(old_rules) }
+    for entry in sorted(stale, key=lambda entry: old_index[id(entry)]):
+        entry['stale'] = True
+        position = next((number for number, other in enumerate(rules) if old_index.get(id(other), -1) > old_index[id(entry)]), len(rules))
+        rules.insert(position, entry)
+
+# Stand-in for cpapi.Writers with --plan: records the api calls of the submitted changes in the
+# order they are submitted, instead of making them. Changes go to the session of their key like
+# in Writers (crc32), every session publishes after publish_every changes of its own, and when a
+# change depends on an unpublished change of another session. With more than one session, the
+# calls are marked with their session.
+# Objects, services and rules that are left as they are go to the plan as 'skip'.
+# steps: list of (command, object type, names, reason)
+class Plan:
+    def __init__(self,publish_every,sessions=1):
+        self.publish_every = publish_every
+        self.sessions = sessions
+        self.steps = []
+        self.unpublished = [0] * sessions
+        self.publishes = [0] * sessions
+
+    def skip(self,obj_type,name,reason):
+        self.steps.append(('skip', obj_type, [name], reason))
+
+    def session(self,key):
+        return zlib.crc32(str(key).encode()) % self.sessions
+
+    def submit(self,key,function,*args,depends=(),changes=1):
+        index = self.session(key)
+        # changes of other sessions are published first
+        for depend in depends:
+            if depend is not None and depend.session != index and depend.publish == self.publishes[depend.session]:
+                self.publish(depend.session)
+        label = 'session ' + str(index + 1) if self.sessions > 1 else ''
+        if function is create_objects or function is create_services or function is add_rules:
+            obj_type, names = planned_names(function, args)
+            if batch_size:
+                self.steps.append(('add-objects-batch', obj_type, names, label))
+            else:
+                self.steps.extend(('add-' + obj_type, obj_type, [name], label) for name in names)
+        elif function is create_layer_call:
+            self.steps.append(('add-access-layer', 'access-layer', [layer_name], label))
+        elif function is delete_rules:
+            self.steps.extend(('delete-access-rule', 'access-rule', [entry['key']], label) for entry in args[0])
+        future = Future()
+        future.set_result(changes)
+        # published with the next publish of its session
+        future.session = index
+        future.publish = self.publishes[index]
+        self.unpublished[index] += changes
+        if self.unpublished[index] >= self.publish_every:
+            self.publish(index)
+        return future
+
+    def publish(self,index=0):
+        self.steps.append(('publish', '', [], 'session ' + str(index + 1) if self.sessions > 1 else ''))
+        self.unpublished[index] = 0
+        self.publishes[index] += 1
+
+    def wait(self,pending=0):
+        pass
+
+    def close(self):
+        for index in range(self.sessions):
+            if self.unpublished[index]:
+                self.publish(index)
+        return []
+
+# object type and check point names of the objects created by a change (see Plan)
+def planned_names(function,args):
+    if function is create_objects:
+        return args[0], [candidate[1] for candidate in args[1]]
+    if function is create_services:
+        return 'service-' + args[0], [service_cache[(args[0], port)] for port in args[1]]
+    return 'access-rule', [new_rule[1]['name'] for new_rule in args[0]]
+
+# Expected seconds of a planned api call from the latency statistics of earlier imports:
+# batch calls per object (including the wait for their task), all others per call.
+# None if there are no statistics for it.
+def planned_seconds(stats,command,obj_type,items):
+    if command == 'add-objects-batch':
+        entry = stats.get('task:add-objects-batch:' + obj_type)
+        return entry['seconds'] / entry['items'] * items if entry and entry['items'] else None
+    entry = stats.get('task:publish' if command == 'publish' else command)
+    return entry['seconds'] / entry['count'] if entry and entry['count'] else None
+
+# Expected time of a plan. Rule batches and publishes run one after another, all other calls
+# max_in_flight at a time in every session. Output: seconds, commands without statistics
+def plan_time(steps,stats,sessions):
+    serial = 0.0
+    parallel = 0.0
+    unknown = set()
+    for command, obj_type, names, reason in steps:
+        if command == 'skip':
+            continue
+        seconds = planned_seconds(stats, command, obj_type, len(names))
+        if seconds is None:
+            unknown.add(command + (' ' + obj_type if command == 'add-objects-batch' else ''))
+            seconds = default_latency
+        if obj_type == 'access-rule' and command != 'delete-access-rule' or command == 'publish':
+            serial += seconds
+        else:
+            parallel += seconds
+    return serial + parallel / (max_in_flight * sessions), sorted(unknown)
+
+# Write plan to file, one api call per line. Output: counts per command and object type
+def write_plan(path,steps):
+    counts = {}
+    with open(path, 'w') as file:
+        for number, (command, obj_type, names, reason) in enumerate(steps, start=1):
+            file.write(' '.join(part for part in (str(number), command, obj_type, str(len(names)) + ':' if names else '', ' '.join(names)) if part))
+            file.write(' (' + reason + ')\n' if reason else '\n')
+            entry = counts.setdefault((command, obj_type), [0, 0])
+            entry[0] += 1
+            entry[1] += len(names)
+    return counts
+
+def load_stats(path):
+    if os.path.isfile(path):
+        with open(path) as file:
+            return json.load(file)
+    return {}
+
 # Check if https to management is working (port 443 open)
 def port_open(ip,port):
+    # host may be given as address:port, e.g. for a local test server (mock-mgmt.py)
+    if ':' in ip:
+        ip, port = ip.rsplit(':', 1)
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
         sock.settimeout(1)
@@ -71,301 +364,553 @@ def port_open(ip,port):
     except:
         return False
 
-# The main function: Do web_api call and return json structure to work on
-def api_call(ip_addr, command, json_payload, sid):
-    url = 'https://' + ip_addr + '/web_api/' + command
-    if sid == '':
-        request_headers = {'Content-Type' : 'application/json'}
-    else:
-        request_headers = {'Content-Type' : 'application/json', 'X-chkp-sid' : sid}
-    response = requests.post(url,data=json.dumps(json_payload), headers=request_headers, verify = False)
-    status_code = response.status_code
-    return [status_code, response.json()]
-
-# login: read netrc file and extract credentials for host if any
-# then do login and return sid or login error
-def api_login(cp_mgmt,netrc_file):
-    # get login credentials from .netrc file
-    auth = netrc.netrc(netrc_file)
-    token = auth.authenticators(cp_mgmt)
-    if token:
-        user = token[0]
-        password = token[2]
-    else:
-        quit('Host not found in netrc file. Exiting.')
-    # do login
-    payload_local = {'user':user, 'password' : password}
-    response = api_call(cp_mgmt,'login',payload_local,'')
-    if str(response[0]) == '200':
-        return response[1]["sid"]
-    else:
-        return 'Login error'
-
-# Check if object with given name is present in Check Point database
-def object_exists(object_local,type_local,host_local,sid_local):
-    # set payload for api call - other settings (limit etc.) not needed here
-    payload = { 
-        "type" : type_local,
-        "filter" : object_local 
-    }
-    # issue api call and store response elements (0 = response code, 1 = data)
-    response = api_call(host_local, 'show-objects', payload, sid_local)
-    if str(response[0]) == '200':
-        total = response[1]['total']
-        if total > 0:
-            return(True)
-        else:
-            return(False) 
-    else:
-        print(response[1])
-        quit('Unknown response in api call') 
-
-# Check if service exists in Check Point database
-def service_exists(service_local,type_local,host_local,sid_local):
-    if type_local == 'tcp':
-        api_command = 'show-services-tcp'
-    else:
-        api_command = 'show-services-udp'
-    payload_local = { "filter" : service_local }
-    response_local = api_call(host_local,api_command,payload_local,sid_local) 
-    if str(response_local[0]) == '200':
-        total = response_local[1]['total']
-        if total > 0:
-            return(True)
-        else:
-            return(False)
-    else:
-        print(response[1])
-        quit('Unknown response in api call')
-
 ##################
 ## main section
 ##################
 
+parser = argparse.ArgumentParser(description='Import objects and rules exported with parse-acl.py to a Check Point management.')
+parser.add_argument('--plan', action='store_true', help='only plan the import: list the api calls in ' + plan_file + ' and estimate the time, no changes')
+parser.add_argument('--sessions', type=int, default=write_sessions, help='number of sessions making changes (default ' + str(write_sessions) + ')')
+parser.add_argument('--acl', help='import only this acl of the rules file, into a layer of its own')
+args = parser.parse_args()
+
+# Check credentials file, quit if not there (--plan does not log in)
+if not args.plan and not os.path.isfile(auth_file):
+    quit('Credentials file not found. Exiting.')
+
+objects_in = input_file(objects_in)
+rules_in = input_file(rules_in)
+
+# Every acl is a first-match rulebase of its own, so the acls of a rules file can't share one
+# layer. With --acl, the rules of that acl go to layer '<layer_name>_<acl>', with state and
+# journal files of their own. A rules file with several acls needs --acl (one import per acl).
+try:
+    rule_acls = { rule.get('acl', '') for line_number, rule in aclformat.read(rules_in, 'rules') }
+except aclformat.FormatError as error:
+    quit(str(error))
+if args.acl:
+    if args.acl not in rule_acls:
+        quit('No rules of acl ' + args.acl + ' in ' + rules_in + '. Exiting.')
+    layer_name = layer_name + '_' + args.acl
+    state_file = state_file.replace('.json', '-' + args.acl + '.json')
+    journal_file = journal_file.replace('.db', '-' + args.acl + '.db')
+elif len(rule_acls) > 1:
+    quit('Rules of several acls in ' + rules_in + ' (' + ', '.join(sorted(rule_acls)) + '), import one at a time with --acl. Exiting.')
+state = load_state(state_file)
+
+# plan without any api call: the management database is taken from the snapshot of the last
+# import, published changes of an interrupted import from its journal
+plan = None
+if args.plan:
+    plan = Plan(publish_every, args.sessions)
+    client = None
+    snapshot = cpapi.Snapshot(None)
+    if os.path.isfile(snapshot_file):
+        snapshot_info = snapshot.read(snapshot_file)
+        if snapshot_info['host'] != host:
+            print('Snapshot ' + snapshot_file + ' is for another host, ignored.')
+            snapshot = cpapi.Snapshot(None)
+        else:
+            print('Using snapshot of management database from ' + snapshot_info['time'] + '.')
+    else:
+        print('No snapshot of management database (' + snapshot_file + '), objects not in ' + state_file + ' are planned as new.')
+    if os.path.isfile(journal_file):
+        journal = cpapi.Journal(journal_file)
+        if journal.get('host', host) == host and journal.get('layer', layer_name) == layer_name:
+            replay_journal(state, journal.changes())
+        journal.close()
+
 # check if management server reachable, quit if not
-if not port_open(host,443):
+elif not port_open(host,443):
     quit('Management unrechable.')
 
-# get session id needed to authorize api call
-sid = api_login(host,auth_file)
-if sid == 'Login error':
-    quit('Login error. Exiting.')
+# get session id needed to authorize api call. all further calls use the
+# pooled keep-alive connections of this client.
+else:
+    client = cpapi.Client(host)
+    sid = client.login_netrc(auth_file)
+    if sid == 'Host not found in netrc file.':
+        quit('Host not found in netrc file. Exiting.')
+    if sid == 'Login error':
+        quit('Login error. Exiting.')
+    snapshot = None
 
-# read objects
-with open(objects_in) as file:
-    # read lines without \n
-    netobjects_in=file.read().splitlines()
+# api call finding a journaled change in the management: objects, services and the layer by
+# name, rules by uid or by name (their key). status 200 if it is there.
+def published_call(change):
+    if change['kind'] in ('access-rule', 'delete-access-rule'):
+        return ('show-access-rule', { 'layer' : layer_name, 'uid' : change['uid'] } if change['uid'] else { 'layer' : layer_name, 'name' : change['key'] })
+    return ('show-' + change['kind'], { 'name' : change['name'] })
 
-# Counter to determine if publish is necessary
-new_obj_count = 0
+# continue an interrupted import: its published changes are done, the unpublished ones are
+# discarded (also in the management, its session may still hold them). if it died during a
+# publish, the management is asked which of the changes are there after the discard (see
+# published_call): that publish went through for them. the session itself may be gone by then.
+if not args.plan:
+    journal = cpapi.Journal(journal_file)
+    if journal.get('host', host) != host or journal.get('layer', layer_name) != layer_name:
+        print('Journal ' + journal_file + ' is for another host or layer, ignored.')
+        journal.clear()
+    sessions = journal.sessions()
+    for session_uid in journal.get('sessions', []):
+        sessions.setdefault(session_uid, False)
+    for session_uid, publishing in sessions.items():
+        if session_uid:
+            client.call('discard', { 'uid' : session_uid })
+        if publishing:
+            pending = journal.pending(session_uid)
+            responses = client.batch([published_call(change) for change in pending], max_in_flight)
+            if any(str(response[0]) != '200' and response[1].get('code') != 'generic_err_object_not_found' for response in responses):
+                quit('Could not check the changes of an interrupted publish. Run again.')
+            # created ones are there, deleted rules are not
+            journal.confirm([change['id'] for change, response in zip(pending, responses) if (str(response[0]) == '200') != (change['kind'] == 'delete-access-rule')])
+        journal.resolve(session_uid)
+    resumed = replay_journal(state, journal.changes())
+    if resumed > 0:
+        print('Continuing interrupted import, changes already done:', str(resumed))
+        save_json(state_file, state)
+        journal.clear()
+    journal.set('host', host)
+    journal.set('layer', layer_name)
+
+# record changes made by a session (api: its client) in the journal
+def journal_record(api,kind,changes):
+    journal.record([dict(change, kind=kind, session=api.session_uid) for change in changes])
 
 # First step: Import host and network object. Naming schema is:
 # - 'host_<ipaddress>'
 # - 'net_<subnet address>_<mask length>'
+# Groups (parse-acl.py --aggregate) keep their name.
 # A comment (see variables) will be added in order to better identify newly created objects in Object Explorer.
 #
 # Second: Create internal table (net2cp_table) to assign netobject to checkpoint-object names for easier rule creation
-# Acl names are in line[0], Check Point object names in line[1]
 #
 # Third: Create shared layer for imported access rules and create access rules in there
-# by reading and interpreting rules file line by line. Rules will also get the same comment as objects.
+# by reading and interpreting rules file record by record. Rules will also get the same comment as objects.
 
 print('Importing network and host objects...')
 
 # Check if object exists, create, if not
 # Note: There is no syntax checking of ip addresses. This is done already in the export script (parse-acl.py) 
+# Objects created or found by the last import (state file) are not checked again. The others
+# are looked up in a local snapshot of existing objects, read once (exact names, no per-object
+# lookups) and only if needed.
+# Objects do not depend on each other, so the creation runs as concurrent batches of api
+# calls with max_in_flight requests at a time.
 objects_skipped = 0
-for netobject in netobjects_in:
-    # check if host or network object, check if already present, tag if not
-    new_object = False
-    # init net2cp table entry
-    net2cp = []
-    split_object = netobject.split('/')
-    net2cp.append(netobject)
-    if split_object[1] == '32':
-        # this is a host object
-        object_name = 'host' + '_' + str(split_object[0])
+candidates = []
+try:
+    for line_number, record in aclformat.read(objects_in, 'objects'):
+        # check if group, host or network object
+        if record['type'] == 'group':
+            # this is a group, members are created before as host or network objects
+            netobject = object_name = record['name']
+            object_type = 'group'
+            api_command = 'add-group'
+            payload = { "name" : object_name, "members" : [cp_object_name(member) for member in record['members']], "comments" : comments }
+            candidates.append([netobject, object_name, object_type, api_command, payload, line_number])
+            continue
+        netobject = record['address']
+        split_object = netobject.split('/')
         object_addr = str(split_object[0])
-        object_type = 'host'
-        if object_exists(object_name,object_type,host,sid):
-            objects_skipped += 1
-            net2cp.append(object_name)
-        else:
-            netobjects.append(object_name)
+        object_name = cp_object_name(netobject)
+        if split_object[1] == '32':
+            # this is a host object
+            object_type = 'host'
             api_command = 'add-host'
             payload = { "name" : object_name, "ip-address" : object_addr, "comments" : comments }
-            new_object = True
-            net2cp.append(object_name)
-    else:
-        # this is a network object
-        object_name = 'net' + '_' + str(split_object[0]) + '_' + str(split_object[1])
-        object_addr = str(split_object[0])
-        object_mask = str(split_object[1])
-        object_type = 'network'
-        if object_exists(object_name,object_type,host,sid):
-            objects_skipped += 1
-            net2cp.append(object_name)
         else:
-            netobjects.append(object_name)
+            # this is a network object
+            object_mask = str(split_object[1])
+            object_type = 'network'
             api_command = 'add-network'
             payload = { "name" : object_name, "subnet" : object_addr, "mask-length" : object_mask, "comments" : comments }
-            new_object = True
-            net2cp.append(object_name)
-    # create new object
-    if new_object:
-        response = api_call(host,api_command,payload,sid)
-        if str(response[0]) == '200':
-            new_obj_count += 1
-            net2cp_table.append(net2cp)
-        else:
-            print('Unknown response:')
-            print(json.dumps(response[1]))
+        candidates.append([netobject, object_name, object_type, api_command, payload, line_number])
+except aclformat.FormatError as error:
+    quit(str(error))
+
+# check which objects are already present
+known_objects = state['objects']
+state['objects'] = {}
+new_objects = []
+for candidate in candidates:
+    # net2cp table entry: acl name -> check point name
+    if candidate[0] in known_objects and known_objects[candidate[0]]['name'] == candidate[1]:
+        objects_skipped += 1
+        net2cp_table[candidate[0]] = candidate[1]
+        state['objects'][candidate[0]] = known_objects[candidate[0]]
+        if plan:
+            plan.skip(candidate[2], candidate[1], 'imported before')
+        continue
+    if snapshot is None:
+        try:
+            snapshot = cpapi.Snapshot(client).load()
+        except cpapi.ApiError as error:
+            print(error.data)
+            quit('Unknown response in api call')
+        snapshot.save(snapshot_file)
+    if snapshot.exists(candidate[1], candidate[2]):
+        objects_skipped += 1
+        net2cp_table[candidate[0]] = candidate[1]
+        state['objects'][candidate[0]] = { 'name' : candidate[1], 'uid' : snapshot.lookup_name(candidate[1]).get('uid', '') }
+        if plan:
+            plan.skip(candidate[2], candidate[1], 'exists')
     else:
-        net2cp_table.append(net2cp)
-
-# publish if new object count > 0
-if new_obj_count > 0:
-    print('Publishing objects...')
-    response = api_call(host, 'publish', {}, sid)
-    task_id = response[1]['task-id']
-    payload = { "task-id" : task_id, "details-level" : "full" }
-    task_status = ''
-    while not (task_status == 'succeeded'):
-        time.sleep(1)
-        response = api_call(host,'show-task',payload,sid)
-        task_status = response[1]['tasks'][0]['status']
-    if objects_skipped > 0:
-        print('Objects skipped: ', str(objects_skipped))
-else:
-    print('No objects created.')
+        netobjects.append(candidate[1])
+        new_objects.append(candidate)
 
 # Read service replacement table from file
-with open(service_replace) as file:
-    service_table = json.load(file)
-
-# open rules.txt in a list removing line feeds and do data format magic with ast because
-# lines in rules.txt already has list format (['item','item']). Pretty sure this could be done much easier...     
-with open(rules_in) as file:
-    rules_raw=file.read().splitlines()
-rules = [ast.literal_eval(line) for line in rules_raw]
-
-# create shared layer
-payload = { }
-response = api_call(host, 'show-access-layers', payload, sid)
-if str(response[0]) == '200':
-    access_layers = response[1]['access-layers']
-    layer_name_check = False
-    for check_layer in access_layers:
-        if check_layer['name'] == layer_name:
-            layer_name_check = True
-    if layer_name_check:
-        print('Layer ' + layer_name + ' already created, skipping.')
-    else:
-        payload = { "name" : layer_name, "shared" : "true", "comments" : comments }
-        print('Creating shared layer...')
-        response = api_call(host, 'add-access-layer', payload, sid)
-        if str(response[0]) == '200':
-            response = api_call(host, 'publish', {}, sid)
-            task_id = response[1]['task-id']
-            payload = { "task-id" : task_id, "details-level" : "full" }
-            task_status = ''
-            while not (task_status == 'succeeded'):
-                response = api_call(host,'show-task',payload,sid)
-                task_status = response[1]['tasks'][0]['status']
+if os.path.isfile(service_replace):
+    with open(service_replace) as file:
+        service_table = json.load(file)
+
+# objects of the last import that are not in the objects file any more are not deleted,
+# they may be used in other rules by now
+removed_objects = len([netobject for netobject in known_objects if netobject not in state['objects']])
+if removed_objects > 0:
+    print('Objects not in ' + objects_in + ' any more (not deleted):', str(removed_objects))
+
+# Every rule is named after its content key (see keyed_rules). Rules of the last import still
+# in the rules file and in the same order stay, the others are deleted first. The rules file is
+# read twice, once for the keys only. Stale rules (see merge_stale_rules) are deleted anyway.
+old_rules = state['rules']
+known_rules = { entry['key'] : (index, entry) for index, entry in enumerate(old_rules) if not entry.get('stale') }
+state['rules'] = []
+try:
+    rule_keys = []
+    rule_ports = {}
+    for line_number, rule, key in keyed_rules(acl_rules(aclformat.read(rules_in, 'rules'))):
+        rule_keys.append(key)
+        if rule['protocol'] in ('tcp', 'udp') and not (rule['operator'] == 'eq' and str(rule['port']) in service_table):
+            rule_ports[key] = (rule['protocol'], aclformat.service_ports(rule['protocol'], rule['operator'], rule['port']))
+    kept_keys = unchanged_rules(rule_keys, known_rules)
+except aclformat.FormatError as error:
+    quit(str(error))
+
+# services for tcp/udp ports and port ranges of the new rules. services found or created by
+# the last import are taken from the state, all others are looked up in the existing services
+# (read once, local snapshot indexed by port), missing ones are created (see below). the result
+# goes to service_cache, so the rules need no lookups any more.
+needed_ports = { (protocol, port) for key, (protocol, ports) in rule_ports.items() if key not in kept_keys and ports for port in ports }
+missing_ports = []
+for protocol, port in sorted(needed_ports):
+    if protocol + '/' + port in state['services']:
+        service_cache[(protocol, port)] = state['services'][protocol + '/' + port]
+        needed_ports.discard((protocol, port))
+        if plan:
+            plan.skip('service-' + protocol, service_cache[(protocol, port)], 'imported before')
+if needed_ports:
+    if snapshot is None:
+        # only the services are read, the objects of the saved snapshot stay in it (see --plan)
+        snapshot = cpapi.Snapshot(client)
+        if os.path.isfile(snapshot_file) and snapshot.read(snapshot_file)['host'] != host:
+            snapshot = cpapi.Snapshot(client)
+        try:
+            snapshot.refresh(['service-tcp', 'service-udp'])
+        except cpapi.ApiError as error:
+            print(error.data)
+            quit('Unknown response in api call')
+        snapshot.save(snapshot_file)
+    for protocol, port in sorted(needed_ports):
+        names = snapshot.lookup_port(protocol, port)
+        if names:
+            service_cache[(protocol, port)] = names[0]
+            state['services'][protocol + '/' + port] = names[0]
+            if plan:
+                plan.skip('service-' + protocol, names[0], 'exists')
         else:
-            print(response[1]['message'])
-else:
-    print(response[1]['message'])
+            service_cache[(protocol, port)] = protocol + '_' + port
+            missing_ports.append((protocol, port))
 
-# loop through rules and create firewall rules
-rule_count = 0
-dummy_count = 0
-skipped_count = 0
-print('Creating firewall rules...')
-for rule in rules:
-    # Get source and destination, common for all kinds of rules
-    if rule[1] == 'any':
-        src = 'Any'
-    else:
-        for line in net2cp_table:
-            if rule[1] == line[0]:
-                src = line[1]
-    if rule[2] == 'any':
-        dst = 'Any'
-    else:
-        for line in net2cp_table:
-            if rule[2] == line[0]:
-                dst = line[1]
-    # First: IP Any rules
-    if rule[0] == 'ip':
-        if rule[4] == 'accept':
-            action = 'Accept'
+# check if shared layer exists, not checked again if it was created or found by the last import
+create_layer = False
+if plan:
+    # without api calls, only the state knows the layer
+    create_layer = not state['layer-created']
+    if not create_layer:
+        plan.skip('access-layer', layer_name, 'imported before')
+elif not state['layer-created']:
+    response = client.call('show-access-layers', { })
+    if str(response[0]) == '200':
+        if layer_name in [check_layer['name'] for check_layer in response[1]['access-layers']]:
+            print('Layer ' + layer_name + ' already created, skipping.')
+            state['layer-created'] = True
         else:
-            action = 'Drop'
-        payload = { 
-            "layer" : layer_name, 
-            "position" : "bottom", 
-            "action" : action, 
-            "destination" : dst,
-            "service" : "Any",
-            "source" : src,
-            "track" : { "type" : "Log" },
-            "comments" : comments
-        }    
-        response = api_call(host, 'add-access-rule', payload, sid)
+            create_layer = True
+    else:
+        print(response[1]['message'])
+
+# The changes are made as pipelines in write_sessions sessions (see cpapi.Writers and Pipeline):
+# every change starts as soon as the changes it depends on are done (and published, if another
+# session made them), max_in_flight at a time per session, with a publish every publish_every
+# changes or publish_interval seconds. Objects and services go to a session by name, the layer,
+# the deletion of old rules and the rules to the session of the layer:
+# - hosts, networks, services, layer and the deletion of old rules: no dependencies
+# - groups: the hosts and networks of their members
+# - rules (batch_size at a time): their objects and services, the layer, the deletion, and the
+#   rules before them (rule order)
+# Objects, services and rules get their check point names before they are created, so rules
+# can be prepared while their objects are still on the way. A session logs in with its first
+# change, a rerun with nothing to do logs in no extra session.
+
+# Every change that worked is recorded in the journal (see replay_journal). Objects and services
+# locked by another session (e.g. an administrator working on them) are tried again in another
+# session (see cpapi.Writers), the ones still locked in the end count as failed (see locked_items).
+# Rules are not, they are placed below the rule before them, which the other sessions do not see
+# before it is published. The functions get the client of the session they run in.
+
+def create_objects(api,object_type,chunk):
+    done = []
+    locked = []
+    for candidate, response in zip(chunk, api.add_batch(object_type, [candidate[4] for candidate in chunk], batch_size, max_workers=1)):
         if str(response[0]) == '200':
-            rule_count += 1
+            state['objects'][candidate[0]] = { 'name' : candidate[1], 'uid' : response[1].get('uid', '') }
+            if not response[1].get('uid'):
+                unread_objects[candidate[1]] = object_type
+            done.append({ 'key' : candidate[0], 'name' : candidate[1], 'uid' : response[1].get('uid', '') })
+        elif cpapi.pushback(response) == 'lock':
+            locked.append(candidate)
         else:
-            print('Rule creation failed', str(rule))
-    elif rule[0] == 'icmp':
-        if rule[4] == 'accept':
-            action = 'Accept'
+            print('Object creation failed (' + objects_in + ' line ' + str(candidate[5]) + ', ' + candidate[0] + '):')
+            print(json.dumps(response[1]))
+    journal_record(api, object_type, done)
+    if locked:
+        raise cpapi.Locked(len(done), object_type, locked)
+    return len(done)
+
+def create_services(api,protocol,ports):
+    done = []
+    locked = []
+    items = [{ "name" : service_cache[(protocol, port)], "port" : port, "comments" : comments } for port in ports]
+    for port, response in zip(ports, api.add_batch('service-' + protocol, items, batch_size, max_workers=1)):
+        if str(response[0]) == '200':
+            state['services'][protocol + '/' + port] = service_cache[(protocol, port)]
+            done.append({ 'key' : protocol + '/' + port, 'name' : service_cache[(protocol, port)], 'uid' : response[1].get('uid', '') })
+        elif cpapi.pushback(response) == 'lock':
+            locked.append(port)
         else:
-            action = 'Drop'
-        if rule[3] == 'any':
-            service = 'icmp-proto'
+            print('Service creation failed (' + protocol + ' ' + port + '):', response[1].get('message', ''))
+    journal_record(api, 'service-' + protocol, done)
+    if locked:
+        raise cpapi.Locked(len(done), protocol, locked)
+    return len(done)
+
+def create_layer_call(api):
+    print('Creating shared layer...')
+    response = api.call('add-access-layer', { "name" : layer_name, "shared" : "true", "comments" : comments })
+    if str(response[0]) == '200':
+        state['layer-created'] = True
+        journal_record(api, 'access-layer', [{ 'key' : layer_name, 'name' : layer_name, 'uid' : response[1].get('uid', '') }])
+    else:
+        print(response[1]['message'])
+
+# output: number of rules deleted, state entries of the rules that could not be deleted
+def delete_rules(api,removed_rules):
+    done = []
+    failed = []
+    calls = [('delete-access-rule', { 'layer' : layer_name, 'uid' : entry['uid'] } if entry['uid'] else { 'layer' : layer_name, 'name' : entry['key'] }) for entry in removed_rules]
+    for entry, response in zip(removed_rules, api.batch(calls, max_in_flight)):
+        # not found: deleted by hand, or by a call that was repeated after a server error
+        if str(response[0]) == '200' or response[1].get('code') == 'generic_err_object_not_found':
+            done.append({ 'key' : entry['key'], 'uid' : entry['uid'] })
         else:
-            try:
-                service = service_table[str(rule[3])]
-            except KeyError:
-                skipped_count += 1
-                continue
-        payload = {
-            "layer" : layer_name,
-            "position" : "bottom",
-            "action" : action,
-            "destination" : dst,
-            "service" : service,
-            "source" : src,
-            "track" : { "type" : "Log" },
-            "comments" : comments
-        }
-        response = api_call(host, 'add-access-rule', payload, sid)
+            print('Rule deletion failed (' + entry['key'] + ')', response[1].get('message', ''))
+            failed.append(entry)
+    journal_record(api, 'delete-access-rule', done)
+    return len(done), failed
+
+# position of a new rule: below the rule before it in the rules file. rules that could not be
+# created are passed over, it goes below the one before them then.
+# rule_anchors: key of a new rule -> state entry of the rule before it (None: first rule)
+def rule_position(entry):
+    if not known_rules:
+        return 'bottom'
+    previous = rule_anchors[entry['key']]
+    while previous and previous.get('failed'):
+        previous = rule_anchors[previous['key']]
+    return { 'below' : previous['uid'] or previous['key'] } if previous else 'top'
+
+# Rules of calls without a clear outcome (status 0: no response, batch task timeout or unknown)
+# may be there after all. They are looked up by name (their key), the response of the ones found
+# replaces the call response.
+def found_rules(api,new_rules,responses):
+    unknown = [index for index, response in enumerate(responses) if response[0] == 0]
+    calls = [('show-access-rule', { 'layer' : layer_name, 'name' : new_rules[index][3]['key'] }) for index in unknown]
+    for index, response in zip(unknown, api.batch(calls, max_in_flight)):
         if str(response[0]) == '200':
-            rule_count += 1
-        else:
-            print('Rule creation failed', str(rule))
-    elif rule[0] in ('tcp', 'udp'):
-        if rule[5] == 'accept':
+            responses[index] = response
+    return responses
+
+# add rules in file order, batch_size rules per batch call. positions are set right before
+# the call, so they only refer to rules that are there. if a batch fails, the rules the task
+# names as wrong are left out and the others are sent in a batch again. if it doesn't tell which
+# ones are wrong, the rules are added one by one.
+def add_rules(api,new_rules):
+    done = []
+    pending = new_rules if batch_size else []
+    single = [] if batch_size else new_rules
+    while pending:
+        for new_rule in pending:
+            new_rule[1]['position'] = rule_position(new_rule[3])
+        responses = api.add_batch('access-rule', [new_rule[1] for new_rule in pending], batch_size, fallback=False)
+        if responses[0][1].get('code') == 'batch_failed':
+            single = pending
+            break
+        retry = []
+        for new_rule, response in zip(pending, found_rules(api, pending, responses)):
+            if response[1].get('code') == 'batch_not_run':
+                retry.append(new_rule)
+            else:
+                rule_result(new_rule, response, done)
+        pending = retry
+    for new_rule in single:
+        new_rule[1]['position'] = rule_position(new_rule[3])
+        rule_result(new_rule, found_rules(api, [new_rule], api.add_batch('access-rule', [new_rule[1]], 0))[0], done)
+    journal_record(api, 'access-rule', done)
+    return len(done)
+
+# uid of a created rule, added to done (see journal_record). a rule that was not created is
+# marked failed, the rules after it are placed below the rule before it (see rule_position).
+def rule_result(new_rule,response,done):
+    if str(response[0]) == '200':
+        new_rule[3]['uid'] = response[1].get('uid', '')
+        if not new_rule[3]['uid']:
+            unread_rules.append(new_rule[3])
+        done.append({ 'key' : new_rule[3]['key'], 'name' : new_rule[3]['key'], 'uid' : new_rule[3]['uid'], 'data' : new_rule[1]['position'] })
+    else:
+        new_rule[3]['failed'] = True
+        print('Rule creation failed (' + rules_in + ' line ' + str(new_rule[2]) + ')', json.dumps(new_rule[0]), response[1].get('message', ''))
+
+# Number of objects or services a change created, and the ones (last argument) it could not
+# create because they were still locked by another session after all tries
+def change_count(future):
+    try:
+        return future.result()
+    except cpapi.Locked as locked:
+        return locked.result
+
+def locked_items(future):
+    error = future.exception()
+    if isinstance(error, cpapi.Locked):
+        return error.rest[-1]
+    return []
+
+if plan:
+    pipeline = plan
+else:
+    pipeline = cpapi.Writers(client, args.sessions, max_in_flight, publish_every, publish_interval, journal=journal)
+chunk_size = batch_size or 1
+
+# objects: future of the change creating it by check point name
+object_tasks = {}
+object_futures = []
+for object_type in ('host', 'network', 'group'):
+    typed_objects = [candidate for candidate in new_objects if candidate[2] == object_type]
+    # chunks of objects of the same session
+    for session in sorted({ pipeline.session(candidate[1]) for candidate in typed_objects }):
+        session_objects = [candidate for candidate in typed_objects if pipeline.session(candidate[1]) == session]
+        for start in range(0, len(session_objects), chunk_size):
+            chunk = session_objects[start:start + chunk_size]
+            depends = []
+            if object_type == 'group':
+                depends = [object_tasks.get(member) for candidate in chunk for member in candidate[4]['members']]
+            future = pipeline.submit(chunk[0][1], create_objects, object_type, chunk, depends=depends, changes=len(chunk))
+            object_futures.append(future)
+            for candidate in chunk:
+                object_tasks[candidate[1]] = future
+    if typed_objects and not plan:
+        print('Creating ' + str(len(typed_objects)) + ' ' + object_type + ' objects...')
+if objects_skipped > 0:
+    print('Objects skipped: ', str(objects_skipped))
+# check point names of all objects, also the ones still being created
+for candidate in new_objects:
+    net2cp_table[candidate[0]] = candidate[1]
+
+service_tasks = {}
+service_futures = []
+for protocol in ('tcp', 'udp'):
+    ports = [port for service_protocol, port in missing_ports if service_protocol == protocol]
+    # chunks of services of the same session
+    for session in sorted({ pipeline.session(service_cache[(protocol, port)]) for port in ports }):
+        session_ports = [port for port in ports if pipeline.session(service_cache[(protocol, port)]) == session]
+        for start in range(0, len(session_ports), chunk_size):
+            chunk = session_ports[start:start + chunk_size]
+            future = pipeline.submit(service_cache[(protocol, chunk[0])], create_services, protocol, chunk, changes=len(chunk))
+            service_futures.append(future)
+            for port in chunk:
+                service_tasks[service_cache[(protocol, port)]] = future
+
+layer_task = pipeline.submit(layer_name, create_layer_call) if create_layer else None
+
+# delete rules of the last import that are not in the rules file any more (or moved)
+removed_rules = [entry for entry in old_rules if entry.get('stale') or entry['key'] not in kept_keys]
+delete_task = pipeline.submit(layer_name, delete_rules, removed_rules, changes=len(removed_rules)) if removed_rules else None
+
+# loop through rules and create firewall rules. the rules file is read record by record and
+# every batch_size rules are handed to the pipeline, so the file is never loaded completely.
+# New rules are placed below the rule before them (see rule_position).
+previous_entry = None
+rule_anchors = {}
+previous_task = None
+rule_futures = []
+skipped_count = 0
+kept_count = 0
+new_rules = []
+rule_depends = set()
+if not plan:
+    print('Creating firewall rules...')
+try:
+    for line_number, rule, key in keyed_rules(acl_rules(aclformat.read(rules_in, 'rules'))):
+        if key in kept_keys:
+            # unchanged rule of the last import
+            entry = known_rules[key][1]
+            state['rules'].append(entry)
+            previous_entry = entry
+            kept_count += 1
+            if plan:
+                plan.skip('access-rule', key, 'unchanged')
+            continue
+        # Get source and destination, common for all kinds of rules
+        src = 'Any' if rule['source'] == 'any' else net2cp_table.get(rule['source'])
+        dst = 'Any' if rule['destination'] == 'any' else net2cp_table.get(rule['destination'])
+        if src is None or dst is None:
+            print('Object of rule not created (' + rules_in + ' line ' + str(line_number) + ')', json.dumps(rule))
+            skipped_count += 1
+            continue
+        if rule['action'] == 'accept':
             action = 'Accept'
         else:
             action = 'Drop'
-        if rule[3] == 'eq':
-            try:
-                service = service_table[str(rule[4])]
-            except KeyError:
-                skipped_count += 1
-                continue
-        # Skip rules with service any and protocol set. There is no firewalling use case for that. 
-        elif rule[4] == 'any':
-            skipped_count += 1
-            continue
+        # First: IP Any rules
+        if rule['protocol'] == 'ip':
+            service = 'Any'
+        elif rule['protocol'] == 'icmp':
+            if rule['icmp-type'] == 'any':
+                service = 'icmp-proto'
+            else:
+                try:
+                    service = service_table[str(rule['icmp-type'])]
+                except KeyError:
+                    skipped_count += 1
+                    continue
+        elif rule['protocol'] in ('tcp', 'udp'):
+            # services.json first, then the services found or created above (neq needs two)
+            if rule['operator'] == 'eq' and str(rule['port']) in service_table:
+                service = service_table[str(rule['port'])]
+            else:
+                protocol, ports = rule_ports[key]
+                services = [service_cache.get((protocol, port)) for port in ports or []]
+                if not services or None in services:
+                    print('No service for rule (' + rules_in + ' line ' + str(line_number) + ')', json.dumps(rule))
+                    skipped_count += 1
+                    continue
+                service = services[0] if len(services) == 1 else services
         else:
-            skipped_count += 1
+            print('unknown service')
             continue
         payload = {
             "layer" : layer_name,
-            "position" : "bottom",
+            "name" : key,
             "action" : action,
             "destination" : dst,
             "service" : service,
@@ -373,32 +918,110 @@ for rule in rules:
             "track" : { "type" : "Log" },
             "comments" : comments
         }
-        response = api_call(host, 'add-access-rule', payload, sid)
-        if str(response[0]) == '200':
-            rule_count += 1
-        else:
-            print('Rule creation failed', str(rule))
-    else:
-        print('unknown service')
-if rule_count > 0:
-    print('Publish rules...')
-    response = api_call(host, 'publish', {}, sid)
-    task_id = response[1]['task-id']
-    payload = { "task-id" : task_id, "details-level" : "full" }
-    task_status = ''
-    while not (task_status == 'succeeded'):
-        time.sleep(1)
-        response = api_call(host,'show-task',payload,sid)
-        task_status = response[1]['tasks'][0]['status']
-    if skipped_count > 0:
-        print('Skipped rules:', str(skipped_count))
+        entry = { 'key' : key, 'uid' : '' }
+        state['rules'].append(entry)
+        rule_anchors[key] = previous_entry
+        previous_entry = entry
+        new_rules.append([rule, payload, line_number, entry])
+        for name in [src, dst] + (service if isinstance(service, list) else [service]):
+            rule_depends.add(object_tasks.get(name) or service_tasks.get(name))
+        if len(new_rules) >= chunk_size:
+            previous_task = pipeline.submit(layer_name, add_rules, new_rules, depends=list(rule_depends) + [layer_task, delete_task, previous_task], changes=len(new_rules))
+            rule_futures.append(previous_task)
+            new_rules = []
+            rule_depends = set()
+            # don't read the rules file much faster than the rules are created
+            pipeline.wait(max_in_flight * 2)
+except aclformat.FormatError as error:
+    print(error)
+if new_rules:
+    rule_futures.append(pipeline.submit(layer_name, add_rules, new_rules, depends=list(rule_depends) + [layer_task, delete_task, previous_task], changes=len(new_rules)))
+
+# wait for all changes and the last publish
+publish_results = pipeline.close()
+
+if plan:
+    counts = write_plan(plan_file, plan.steps)
+    print('Planned api calls (no changes made, details in ' + plan_file + '):')
+    print('{:<20}{:<14}{:>8}{:>10}'.format('command', 'type', 'calls', 'objects'))
+    for (command, obj_type), (calls, items) in sorted(counts.items(), key=lambda item: (item[0][0] == 'skip', item[0][0] == 'publish')):
+        print('{:<20}{:<14}{:>8}{:>10}'.format(command, obj_type, calls if command != 'skip' else '', items))
+    seconds, unknown = plan_time(plan.steps, load_stats(stats_file), args.sessions)
+    print('Estimated time: ' + (str(int(seconds // 60)) + ' min ' if seconds >= 60 else '') + str(math.ceil(seconds % 60)) + ' s (' + str(max_in_flight) + ' calls at a time in ' + str(args.sessions) + ' sessions)')
+    if unknown:
+        print('No latency statistics in ' + stats_file + ' for ' + ', '.join(unknown) + ', ' + str(default_latency) + ' s per call assumed.')
+    if seconds > publish_interval:
+        print('Publishes every ' + str(publish_interval) + ' s not included.')
+    quit()
+
+# latency of this import for the next plan
+save_json(stats_file, cpapi.merge_stats(load_stats(stats_file), pipeline.stats()))
+if pipeline.logins_failed > 0:
+    print(str(pipeline.logins_failed) + ' of ' + str(args.sessions) + ' sessions could not log in, their changes were made in the first one.')
+for publish_result in publish_results:
+    if publish_result != 'Publish succeeded':
+        print(publish_result)
+# changes of a session that expired before they were published are lost, the journal knows
+# the published ones only
+change_futures = object_futures + service_futures + rule_futures + [future for future in (layer_task, delete_task) if future]
+if any(isinstance(future.exception(), cpapi.SessionExpired) for future in change_futures):
+    quit('Session expired with unpublished changes, state not saved. Run again to continue.')
+locked_count = sum(len(locked_items(future)) for future in object_futures + service_futures)
+if locked_count > 0:
+    print('Objects and services locked by another session, not created:', str(locked_count))
+state['rules'] = [entry for entry in state['rules'] if not entry.get('failed')]
+new_obj_count = sum(change_count(future) for future in object_futures)
+service_count = sum(change_count(future) for future in service_futures)
+rule_count = sum(future.result() for future in rule_futures)
+deleted_count, failed_deletes = delete_task.result() if delete_task else (0, [])
+# still there, the next import tries again
+merge_stale_rules(state['rules'], failed_deletes, old_rules)
+if new_obj_count > 0 or service_count > 0:
+    print('Objects created:', str(new_obj_count) + ', services created:', str(service_count))
+if skipped_count > 0:
+    print('Skipped rules:', str(skipped_count))
+print('Rules created:', str(rule_count) + ', deleted:', str(deleted_count) + ', unchanged:', str(kept_count))
+
+# without the last publish, the state is not saved. the next run continues from the journal.
+if not pipeline.published():
+    quit('Last publish failed, state not saved. Run again to continue.')
+
+# uids of rules and objects created by batch calls (see unread_rules): the rules are read once
+# from the rulebase, with the objects they use. the other objects are looked up by name.
+unread_rules = [entry for entry in unread_rules if not entry['uid'] and not entry.get('stale')]
+object_uids = {}
+if unread_rules:
+    rule_uids = {}
+    # a stale rule may have the name of a new one
+    stale_uids = { entry['uid'] for entry in state['rules'] if entry.get('stale') }
+    try:
+        for page in client.iter_pages('show-access-rulebase', { 'name' : layer_name, 'use-object-dictionary' : True }):
+            for item in page.get('rulebase', []):
+                # rules may be grouped in sections
+                for rule in item.get('rulebase', [item]):
+                    if rule['uid'] not in stale_uids:
+                        rule_uids[rule.get('name', '')] = rule['uid']
+            for obj in page.get('objects-dictionary', []):
+                object_uids[obj['name']] = obj['uid']
+    except cpapi.ApiError as error:
+        print('Could not read rule uids:', str(error))
+    for entry in unread_rules:
+        entry['uid'] = rule_uids.get(entry['key'], '')
+unread_names = [name for name in unread_objects if name not in object_uids]
+for name, response in zip(unread_names, client.batch([('show-' + unread_objects[name], { 'name' : name }) for name in unread_names], max_in_flight)):
+    if str(response[0]) == '200':
+        object_uids[name] = response[1]['uid']
+for entry in state['objects'].values():
+    entry['uid'] = entry['uid'] or object_uids.get(entry['name'], '')
+save_json(state_file, state)
+journal.clear()
+journal.close()
  
 #################
 ### end main section
 ##################
 
 # be nice and log out
-logout_result = api_call(host, "logout",{},sid)
-logout_message = logout_result[1]['message']
+logout_message = client.logout()
 if logout_message != 'OK':
     print('Logout unsuccessful.')
@@ -0,0 +1,549 @@
+#!/usr/bin/python3
+
+# Local stand-in for the Check Point management web api (/web_api/*) and the Gaia api (/gaia_api/*)
+# Used to run cpapi.py, import-acl.py, export-rulebase.py and friends without a management server,
+# e.g. to measure their throughput and to check changes for performance regressions.
+#
+# Everything lives in memory and is gone when the program stops. Supported calls:
+# login, logout, keepalive, publish, discard, show-task, show-session,
+# show-objects, show-hosts, show-networks, show-groups, show-services-tcp, show-services-udp,
+# add-host, add-network, add-group, add-service-tcp, add-service-udp, add-objects-batch,
+# delete-host, delete-network, delete-group, delete-service-tcp, delete-service-udp,
+# show-access-layers, show-access-layer, add-access-layer, show-access-rule, add-access-rule,
+# delete-access-rule, show-access-rulebase
+# and show-routes-static (gaia). Call statistics: https://<host>:<port>/mock/stats (GET).
+# Objects and layers changed by a session are locked for the other sessions until it publishes or
+# discards, new objects are not visible to them before. A session logged out with unpublished
+# changes keeps them and its locks (like an expired one) until it is discarded by uid.
+#
+# Usage example (set host = '127.0.0.1:8443' in the script to test):
+# ./mock-mgmt.py --port 8443 --latency 0.05 --error-rate 0.01 --rate-limit 50
+#
+# Without --cert and --key, a self signed certificate is created with openssl.
+# dj0Nz
+
+import argparse, json, os, random, shutil, ssl, subprocess, sys, tempfile, threading, time, uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+##########
+# Variables
+
+# object types and the show/add/delete commands working on them
+object_types = {
+    'host' : 'hosts',
+    'network' : 'networks',
+    'group' : 'groups',
+    'service-tcp' : 'services-tcp',
+    'service-udp' : 'services-udp'
+}
+
+# some predefined services, like on a real management
+default_services = [
+    ('service-tcp', 'ssh', '22'), ('service-tcp', 'smtp', '25'), ('service-tcp', 'http', '80'),
+    ('service-tcp', 'https', '443'), ('service-tcp', 'ldap', '389'), ('service-tcp', 'ldap-ssl', '636'),
+    ('service-udp', 'domain-udp', '53'), ('service-udp', 'ntp-udp', '123'), ('service-udp', 'snmp', '161'),
+    ('service-udp', 'syslog', '514')
+]
+
+# static routes shown by the gaia api
+static_routes = [
+    { 'address' : '0.0.0.0', 'mask-length' : 0, 'next-hop' : { 'gateways' : [ { 'address' : '192.168.1.1', 'interface' : 'eth0' } ] } },
+    { 'address' : '192.168.100.0', 'mask-length' : 24, 'next-hop' : { 'gateways' : [ { 'address' : '192.168.1.254', 'interface' : 'eth1' } ] } }
+]
+
+# End variables section
+##########
+
+##########
+# Functions and classes
+
+# In-memory management database. One lock for everything, the api calls are short.
+class Database:
+    def __init__(self,publish_time):
+        self.lock = threading.Lock()
+        self.publish_time = publish_time
+        self.objects = {}
+        self.layers = {}
+        self.sessions = {}
+        self.tasks = {}
+        self.stats = {}
+        # object name or 'layer:<name>' -> session id holding the lock
+        self.locks = {}
+        for obj_type, name, port in default_services:
+            self.add_object(obj_type, { 'name' : name, 'port' : port }, None)
+        self.add_layer({ 'name' : 'Network' }, None)
+
+    def add_object(self,obj_type,payload,sid):
+        obj = { 'uid' : str(uuid.uuid4()), 'name' : payload['name'], 'type' : obj_type,
+                'comments' : payload.get('comments', ''), 'domain' : { 'name' : 'SMC User' } }
+        if obj_type == 'host':
+            obj['ipv4-address'] = payload.get('ip-address', payload.get('ipv4-address'))
+        elif obj_type == 'network':
+            obj['subnet4'] = payload.get('subnet', payload.get('subnet4'))
+            obj['mask-length4'] = int(payload.get('mask-length', payload.get('mask-length4')))
+        elif obj_type == 'group':
+            members = payload.get('members', [])
+            obj['members'] = [members] if isinstance(members, str) else list(members)
+        else:
+            obj['port'] = str(payload['port'])
+        self.objects[obj['name']] = obj
+        self.changed(sid, lambda: self.objects.pop(obj['name'], None))
+        self.take_lock(sid, obj['name'])
+        return obj
+
+    def add_layer(self,payload,sid):
+        layer = { 'uid' : str(uuid.uuid4()), 'name' : payload['name'], 'type' : 'access-layer',
+                  'shared' : str(payload.get('shared', 'false')).lower() == 'true', 'comments' : payload.get('comments', ''), 'rules' : [] }
+        self.layers[layer['name']] = layer
+        self.changed(sid, lambda: self.layers.pop(layer['name'], None))
+        self.take_lock(sid, 'layer:' + layer['name'])
+        return layer
+
+    # count changes per session and remember how to undo them for discard, publish resets both
+    def changed(self,sid,undo=None):
+        if sid in self.sessions:
+            self.sessions[sid]['changes'] += 1
+            if undo:
+                self.sessions[sid]['undo'].append(undo)
+
+    # undo the unpublished changes of a session
+    def discard(self,sid):
+        count = self.sessions[sid]['changes']
+        for undo in reversed(self.sessions[sid]['undo']):
+            undo()
+        self.sessions[sid].update({ 'changes' : 0, 'undo' : [] })
+        self.release_locks(sid)
+        return count
+
+    # lock an object (name) or layer ('layer:<name>') for the other sessions
+    def take_lock(self,sid,name):
+        if sid in self.sessions:
+            self.locks[name] = sid
+
+    # locked by another session than sid
+    def locked(self,sid,name):
+        return self.locks.get(name, sid) != sid
+
+    # release the locks of a session (publish, discard)
+    def release_locks(self,sid):
+        self.locks = { name : owner for name, owner in self.locks.items() if owner != sid }
+
+    def new_task(self,duration,status='succeeded',details=None):
+        task_id = str(uuid.uuid4())
+        self.tasks[task_id] = { 'start' : time.time(), 'duration' : duration, 'status' : status, 'details' : details or [] }
+        return task_id
+
+    def count(self,command,status):
+        entry = self.stats.setdefault(command, { 'count' : 0, 'errors' : 0 })
+        entry['count'] += 1
+        if status != 200:
+            entry['errors'] += 1
+
+# Token bucket for the --rate-limit option, rate = requests per second
+class RateLimit:
+    def __init__(self,rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+# error response in check point format
+def error(status,code,message):
+    return status, { 'code' : code, 'message' : message }
+
+# one page of a list, paged with offset and limit like the real api
+def page(items,payload,key):
+    offset = int(payload.get('offset', 0))
+    limit = int(payload.get('limit', 50))
+    selected = items[offset:offset + limit]
+    result = { key : selected, 'total' : len(items) }
+    if selected:
+        result['from'] = offset + 1
+        result['to'] = offset + len(selected)
+    return result
+
+# error response for an object or layer locked by another session
+def locked_error(name):
+    return error(409, 'err_object_locked', 'Object [' + name + '] is locked by another session')
+
+# object lookup by name or uid
+def find_object(db,payload):
+    if 'name' in payload:
+        return db.objects.get(payload['name'])
+    for obj in db.objects.values():
+        if obj['uid'] == payload.get('uid'):
+            return obj
+    return None
+
+# object exists and is visible to session sid (not new in another session)
+def visible(db,sid,name):
+    return name in db.objects and not db.locked(sid, name)
+
+def find_layer(db,name):
+    for layer in db.layers.values():
+        if name in (layer['name'], layer['uid']):
+            return layer
+    return None
+
+# validate an add-* payload, returns error message or None
+def check_object(db,obj_type,payload,sid):
+    if not payload.get('name'):
+        return 'Missing parameter: [name]'
+    if db.locked(sid, payload['name']):
+        return 'Object [' + payload['name'] + '] is locked by another session'
+    if payload['name'] in db.objects:
+        return 'More than one object have the same name [' + payload['name'] + ']'
+    if obj_type == 'group':
+        members = payload.get('members', [])
+        for member in [members] if isinstance(members, str) else members:
+            if not visible(db, sid, member):
+                return 'Requested object [' + member + '] not found'
+    if obj_type == 'host' and not payload.get('ip-address'):
+        return 'Missing parameter: [ip-address]'
+    if obj_type == 'network' and not (payload.get('subnet') and payload.get('mask-length') is not None):
+        return 'Missing parameter: [subnet, mask-length]'
+    if obj_type.startswith('service-') and not payload.get('port'):
+        return 'Missing parameter: [port]'
+    return None
+
+# validate an add-access-rule payload, returns error message or None
+# pending: names of the rules added before it in the same batch
+def check_rule(db,payload,sid,pending=()):
+    layer = find_layer(db, payload.get('layer', ''))
+    if not layer:
+        return 'Requested object [' + str(payload.get('layer')) + '] not found'
+    if db.locked(sid, 'layer:' + layer['name']):
+        return 'Object [' + layer['name'] + '] is locked by another session'
+    # services are not checked, there are far too many predefined ones
+    for field in ('source', 'destination'):
+        names = payload.get(field, 'Any')
+        for name in [names] if isinstance(names, str) else names:
+            if name != 'Any' and not visible(db, sid, name):
+                return 'Requested object [' + name + '] not found'
+    position = payload.get('position', 'bottom')
+    if isinstance(position, dict):
+        anchor = position.get('above', position.get('below'))
+        if not find_rule(layer, anchor) and anchor not in pending:
+            return 'Requested object [' + str(anchor) + '] not found'
+    return None
+
+# rule of a layer by uid or name
+def find_rule(layer,name):
+    for rule in layer['rules']:
+        if name in (rule['uid'], rule['name']):
+            return rule
+    return None
+
+def insert_rule(db,payload,sid):
+    layer = find_layer(db, payload['layer'])
+    rule = { 'uid' : str(uuid.uuid4()), 'type' : 'access-rule', 'name' : payload.get('name', ''),
+             'action' : payload.get('action', 'Drop'), 'comments' : payload.get('comments', '') }
+    for field in ('source', 'destination', 'service'):
+        names = payload.get(field, 'Any')
+        rule[field] = [names] if isinstance(names, str) else list(names)
+    position = payload.get('position', 'bottom')
+    rules = layer['rules']
+    if position == 'top':
+        rules.insert(0, rule)
+    elif isinstance(position, int) or str(position).isdigit():
+        rules.insert(int(position) - 1, rule)
+    elif isinstance(position, dict):
+        index = rules.index(find_rule(layer, position.get('above', position.get('below'))))
+        rules.insert(index if 'above' in position else index + 1, rule)
+    else:
+        rules.append(rule)
+    db.changed(sid, lambda: rule in rules and rules.remove(rule))
+    db.take_lock(sid, 'layer:' + layer['name'])
+    return rule
+
+# web api commands. input: database, session id, payload. output: http status, json data
+def web_api(db,sid,command,payload):
+    if command == 'login':
+        sid = str(uuid.uuid4())
+        db.sessions[sid] = { 'uid' : str(uuid.uuid4()), 'changes' : 0, 'undo' : [], 'user' : payload.get('user', 'api-key') }
+        return 200, { 'sid' : sid, 'uid' : db.sessions[sid]['uid'], 'session-timeout' : 600, 'api-server-version' : '1.9.1' }
+    if sid not in db.sessions or db.sessions[sid].get('disconnected'):
+        return error(400, 'generic_err_wrong_session_id', 'Wrong session id [' + str(sid) + ']. Session may be expired. Please check session id and resend the request.')
+    if command == 'logout':
+        if db.sessions[sid]['changes']:
+            db.sessions[sid]['disconnected'] = True
+        else:
+            del db.sessions[sid]
+        return 200, { 'message' : 'OK' }
+    if command == 'keepalive':
+        return 200, { 'message' : 'OK' }
+    if command == 'show-session':
+        return 200, { 'uid' : db.sessions[sid]['uid'], 'changes' : db.sessions[sid]['changes'] }
+    if command == 'publish':
+        db.sessions[sid].update({ 'changes' : 0, 'undo' : [] })
+        db.release_locks(sid)
+        return 200, { 'task-id' : db.new_task(db.publish_time) }
+    if command == 'discard':
+        # own session or another one (by uid), e.g. of a script that died
+        if payload.get('uid'):
+            sid = next((other for other, session in db.sessions.items() if session['uid'] == payload['uid']), None)
+            if sid is None:
+                return error(404, 'generic_err_object_not_found', 'Requested object [' + payload['uid'] + '] not found')
+        count = db.discard(sid)
+        if db.sessions[sid].get('disconnected'):
+            del db.sessions[sid]
+        return 200, { 'message' : 'OK', 'number-of-discarded-changes' : count }
+    if command == 'show-task':
+        task = db.tasks.get(payload.get('task-id'))
+        if not task:
+            return error(404, 'generic_err_object_not_found', 'Requested object [' + str(payload.get('task-id')) + '] not found')
+        elapsed = time.time() - task['start']
+        done = elapsed >= task['duration']
+        progress = 100 if done else int(100 * elapsed / task['duration'])
+        return 200, { 'tasks' : [ { 'task-id' : payload['task-id'], 'task-name' : 'mock task',
+            'status' : task['status'] if done else 'in progress', 'progress-percentage' : progress,
+            'task-details' : task['details'] } ] }
+    if command == 'show-objects':
+        items = [obj for obj in db.objects.values() if not db.locked(sid, obj['name'])
+                 and (not payload.get('type') or obj['type'] == payload['type'])
+                 and payload.get('filter', '') in obj['name'] + ' ' + obj.get('ipv4-address', '') + ' ' + obj.get('subnet4', '')]
+        return 200, page(items, payload, 'objects')
+    for obj_type, plural in object_types.items():
+        if command == 'show-' + plural:
+            items = [obj for obj in db.objects.values() if obj['type'] == obj_type and not db.locked(sid, obj['name'])]
+            return 200, page(items, payload, 'objects')
+        if command == 'show-' + obj_type:
+            obj = find_object(db, payload)
+            if not obj or obj['type'] != obj_type or db.locked(sid, obj['name']):
+                return error(404, 'generic_err_object_not_found', 'Requested object [' + str(payload.get('name')) + '] not found')
+            return 200, obj
+        if command == 'add-' + obj_type:
+            message = check_object(db, obj_type, payload, sid)
+            if message and 'locked' in message:
+                return error(409, 'err_object_locked', message)
+            if message:
+                return error(400, 'err_validation_failed', message)
+            return 200, db.add_object(obj_type, payload, sid)
+        if command == 'delete-' + obj_type:
+            obj = find_object(db, payload)
+            if not obj or obj['type'] != obj_type:
+                return error(404, 'generic_err_object_not_found', 'Requested object [' + str(payload.get('name')) + '] not found')
+            if db.locked(sid, obj['name']):
+                return locked_error(obj['name'])
+            del db.objects[obj['name']]
+            db.changed(sid, lambda: db.objects.setdefault(obj['name'], obj))
+            db.take_lock(sid, obj['name'])
+            return 200, { 'message' : 'OK' }
+    if command == 'add-objects-batch':
+        # all or nothing, like the real thing
+        details = []
+        pending = []
+        for batch in payload.get('objects', []):
+            for item in batch.get('list', []):
+                if batch['type'] == 'access-rule':
+                    message = check_rule(db, item, sid, pending)
+                    pending.append(item.get('name', ''))
+                else:
+                    message = check_object(db, batch['type'], item, sid)
+                if message:
+                    details.append({ 'succeeded' : False, 'message' : message, 'name' : item.get('name', '') })
+        if details:
+            return 200, { 'task-id' : db.new_task(0, 'failed', details) }
+        for batch in payload.get('objects', []):
+            for item in batch['list']:
+                if batch['type'] == 'access-rule':
+                    insert_rule(db, item, sid)
+                else:
+                    db.add_object(batch['type'], item, sid)
+        return 200, { 'task-id' : db.new_task(0) }
+    if command == 'show-access-layers':
+        layers = [{ key : value for key, value in layer.items() if key != 'rules' } for layer in db.layers.values()]
+        return 200, page(layers, payload, 'access-layers')
+    if command == 'show-access-layer':
+        layer = find_layer(db, payload.get('name', payload.get('uid', '')))
+        if not layer:
+            return error(404, 'generic_err_object_not_found', 'Requested object [' + str(payload.get('name')) + '] not found')
+        return 200, { key : value for key, value in layer.items() if key != 'rules' }
+    if command == 'add-access-layer':
+        if payload.get('name') in db.layers:
+            return error(400, 'err_validation_failed', 'More than one object have the same name [' + payload['name'] + ']')
+        return 200, db.add_layer(payload, sid)
+    if command == 'add-access-rule':
+        message = check_rule(db, payload, sid)
+        if message and 'locked' in message:
+            return error(409, 'err_object_locked', message)
+        if message:
+            return error(404, 'generic_err_object_not_found', message)
+        return 200, insert_rule(db, payload, sid)
+    if command == 'show-access-rule':
+        layer = find_layer(db, payload.get('layer', ''))
+        rule = find_rule(layer, payload.get('uid', payload.get('name'))) if layer else None
+        if not rule:
+            return error(404, 'generic_err_object_not_found', 'Requested object [' + str(payload.get('uid', payload.get('name'))) + '] not found')
+        return 200, dict(rule, layer=layer['uid'])
+    if command == 'delete-access-rule':
+        layer = find_layer(db, payload.get('layer', ''))
+        if layer and db.locked(sid, 'layer:' + layer['name']):
+            return locked_error(layer['name'])
+        if layer:
+            for rule in layer['rules']:
+                if payload.get('uid') == rule['uid'] or (payload.get('name') and payload['name'] == rule['name']) or str(payload.get('rule-number')) == str(layer['rules'].index(rule) + 1):
+                    index = layer['rules'].index(rule)
+                    layer['rules'].remove(rule)
+                    db.changed(sid, lambda: layer['rules'].insert(index, rule))
+                    db.take_lock(sid, 'layer:' + layer['name'])
+                    return 200, { 'message' : 'OK' }
+        return error(404, 'generic_err_object_not_found', 'Requested object not found')
+    if command == 'show-access-rulebase':
+        layer = find_layer(db, payload.get('name', payload.get('uid', '')))
+        if not layer:
+            return error(404, 'generic_err_object_not_found', 'Requested object [' + str(payload.get('name')) + '] not found')
+        rules = [dict(rule, **{ 'rule-number' : number }) for number, rule in enumerate(layer['rules'], start=1)]
+        result = page(rules, payload, 'rulebase')
+        result.update({ 'uid' : layer['uid'], 'name' : layer['name'] })
+        if str(payload.get('use-object-dictionary', 'true')).lower() == 'true':
+            names = { name for rule in result['rulebase'] for field in ('source', 'destination', 'service') for name in rule[field] }
+            result['objects-dictionary'] = [db.objects[name] for name in sorted(names) if name in db.objects]
+        return 200, result
+    return error(404, 'generic_err_command_not_found', 'Unknown command [' + command + ']')
+
+# gaia api commands, only login/logout and the static routes
+def gaia_api(db,sid,command,payload):
+    if command in ('login', 'logout', 'keepalive'):
+        return web_api(db, sid, command, payload)
+    if sid not in db.sessions:
+        return error(400, 'generic_err_wrong_session_id', 'Wrong session id [' + str(sid) + '].')
+    if command == 'show-routes-static':
+        return 200, page(static_routes, payload, 'objects')
+    return error(404, 'generic_err_command_not_found', 'Unknown command [' + command + ']')
+
+# http(s) request handler. keep-alive (http/1.1), so connection pooling of the clients works.
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self,format,*args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self,status,data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/mock/stats':
+            with self.server.db.lock:
+                stats = json.loads(json.dumps(self.server.db.stats))
+            self.send_json(200, stats)
+        else:
+            self.send_json(404, { 'message' : 'Not found' })
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            payload = None
+        parts = self.path.strip('/').split('/')
+        command = parts[-1]
+        options = self.server.options
+        # one call of a session at a time, the others of the session wait
+        session_lock = self.server.session_lock(self.headers.get('X-chkp-sid')) if options.serial_sessions else threading.Lock()
+        with session_lock:
+            self.handle_call(parts, command, payload)
+
+    def handle_call(self,parts,command,payload):
+        options = self.server.options
+        if options.latency:
+            time.sleep(max(0, random.gauss(options.latency, options.latency * options.jitter)))
+        if payload is None:
+            status, data = error(400, 'generic_err_invalid_syntax', 'Invalid json in request body')
+        elif options.rate_limit and not self.server.rate_limit.allow():
+            status, data = error(429, 'err_too_many_requests', 'Too many requests, try again later')
+        elif options.error_rate and command not in ('login', 'logout') and random.random() < options.error_rate:
+            status, data = random.choice([
+                error(500, 'generic_internal_error', 'Internal error'),
+                error(503, 'generic_err_server_busy', 'Management server is busy, try again later')])
+        elif len(parts) != 2 or parts[0] not in ('web_api', 'gaia_api'):
+            status, data = error(404, 'generic_err_command_not_found', 'Unknown api path')
+        else:
+            api = web_api if parts[0] == 'web_api' else gaia_api
+            with self.server.db.lock:
+                status, data = api(self.server.db, self.headers.get('X-chkp-sid'), command, payload)
+        with self.server.db.lock:
+            self.server.db.count(command, status)
+        self.send_json(status, data)
+
+# http server with a lock per session id (--serial-sessions)
+class Server(ThreadingHTTPServer):
+    def session_lock(self,sid):
+        with self.db.lock:
+            return self.session_locks.setdefault(sid, threading.Lock())
+
+# self signed certificate for localhost, created with openssl in a temporary directory
+def create_certificate():
+    if not shutil.which('openssl'):
+        quit('openssl not found, use --cert and --key.')
+    cert_dir = tempfile.mkdtemp(prefix='mock-mgmt-')
+    cert = os.path.join(cert_dir, 'cert.pem')
+    key = os.path.join(cert_dir, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                    '-keyout', key, '-out', cert], check=True, capture_output=True)
+    return cert, key
+
+# End functions section
+##########
+
+##################
+### main program
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Check Point management and Gaia api.')
+    parser.add_argument('--bind', default='127.0.0.1', help='address to listen on (default 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8443, help='port to listen on (default 8443)')
+    parser.add_argument('--cert', help='certificate file (pem)')
+    parser.add_argument('--key', help='private key file (pem)')
+    parser.add_argument('--latency', type=float, default=0, help='mean latency per call in seconds')
+    parser.add_argument('--jitter', type=float, default=0.2, help='latency standard deviation as fraction of latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of calls failing with 500/503')
+    parser.add_argument('--rate-limit', type=float, default=0, help='max. requests per second, more get 429')
+    parser.add_argument('--serial-sessions', action='store_true', help='calls of a session run one after another, like on a real management')
+    parser.add_argument('--publish-time', type=float, default=2, help='seconds a publish task is in progress')
+    parser.add_argument('--hosts', type=int, default=0, help='number of host objects created at start')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    options = parser.parse_args()
+
+    db = Database(options.publish_time)
+    for num in range(options.hosts):
+        address = '10.' + str(num >> 16 & 255) + '.' + str(num >> 8 & 255) + '.' + str(num & 255)
+        db.add_object('host', { 'name' : 'host_' + address, 'ip-address' : address }, None)
+
+    server = Server((options.bind, options.port), Handler)
+    server.daemon_threads = True
+    server.session_locks = {}
+    server.db = db
+    server.options = options
+    server.verbose = options.verbose
+    server.rate_limit = RateLimit(options.rate_limit)
+
+    cert, key = (options.cert, options.key) if options.cert and options.key else create_certificate()
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+
+    print('Mock management listening on https://' + options.bind + ':' + str(options.port), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+### end main program
+##################
@@ -12,28 +12,40 @@
 
 # dj0Nz Mar 2024
 
-import re, ipaddress, json
+import argparse, glob, hashlib, ipaddress, json, os, re
+import aclformat
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
-# Input: Cisco Extended ACL, named
+# Input: Cisco Extended ACL, named, or a complete running-config with any number of
+# named and numbered acls (can be given as argument)
 infile = 'acl.txt'
 
 # Output files (should ;)) contain Check Point API commands to import objects or rules 
-objects_out = 'netobjects.txt'
-rules_out = 'rules.txt'
-
-# Lists for network objects and rules
-ciscoacls_filtered = []
-netobjects = []
-rules = []
-
-# Regex pattern to filter unneeded rules
-established_pattern = re.compile('established')
-ospf_pattern = re.compile('ospf')
-
-# Regex pattern to identify wildcard masks
-wildcard_pattern = re.compile('^0\\.')
-
-# Function: Valid IPv4 address?
+# Objects and rules are json lines, see aclformat.py. With --gzip, .gz is appended and they are compressed.
+objects_out = 'netobjects.jsonl'
+rules_out = 'rules.jsonl'
+report_out = 'report.txt'
+
+# Batch mode (directory or glob of configs): one rules and report file per device,
+# named after the config file, e.g. rules-router1.jsonl. Objects of all devices go to objects_out.
+device_rules_out = 'rules-{}.jsonl'
+device_report_out = 'report-{}.txt'
+
+# Numbered acls: ranges of standard and extended acl numbers
+standard_numbers = (range(1, 100), range(1300, 2000))
+extended_numbers = (range(100, 200), range(2000, 2700))
+
+# Keywords of the tokenizer
+actions = ('permit', 'deny')
+port_operators = ('eq', 'lt', 'gt', 'neq')
+ports_protocols = ('tcp', 'udp')
+
+# Prefix of group names created by aggregate_rules
+group_prefix = 'grp_acl_'
+
+# Function: Valid IPv4 address? Addresses repeat a lot in acls, so results are cached
+@lru_cache(maxsize=65536)
 def is_ipv4(input_address):
     try:
         valid_ip = ipaddress.IPv4Address(input_address)
@@ -41,406 +53,634 @@ def is_ipv4(input_address):
     except:
         return False
 
-# Function: Convert wildcard mask to prefix length
+# Function: Convert wildcard mask to prefix length (ValueError if not a valid wildcard mask)
+# There are only a few different masks, so results are cached
+@lru_cache(maxsize=64)
 def convert_wildcard (wildcardmask):
     prefixlen=str(ipaddress.IPv4Address._prefix_from_ip_int(int(ipaddress.IPv4Address(wildcardmask))^(2**32-1)))
     return(prefixlen)
 
-# Function: Get source and destination for rule
-def get_src_dst (acl_local,netobjects_local):
-
-    # Get source from netobjects list or any
-    src_local = ''
-    if acl_local[2] == 'any':
-        src_local = 'any'
-    elif acl_local[2] == 'host':
-        num=len(netobjects_local)
-        for index in range(0, num):
-            found = re.search(rf'^{acl_local[3]}',netobjects_local[index])
-            if found:
-                src_local = netobjects_local[index]
-    else:
-        num=len(netobjects_local)
-        for index in range(0, num):
-            found = re.search(rf'^{acl_local[2]}',netobjects_local[index])
-            if found:
-                src_local = netobjects_local[index]
-
-    # Get destination from netobjects list
-    dst_local = ''
-    if acl_local[2] == 'any':
-        if acl_local[3] == 'host':
-            num=len(netobjects_local)
-            for index in range(0, num):
-                found = re.search(rf'^{acl_local[4]}',netobjects_local[index])
-                if found:
-                    dst_local = netobjects_local[index]
-        elif acl_local[3] == 'any':
-            dst_local = 'any'
-        else:
-            num=len(netobjects_local)
-            for index in range(0, num):
-                found = re.search(rf'^{acl_local[3]}',netobjects_local[index])
-                if found:
-                    dst_local = netobjects_local[index]
-    else:
-        if not acl_local[4] == 'any':
-            num=len(netobjects_local)
-            if acl_local[4] == 'host':
-                dest_search = acl_local[5]
-            else:
-                dest_search = acl_local[4]
-            for index in range(0, num):
-                found = re.search(rf'^{dest_search}',netobjects_local[index])
-                if found:
-                    dst_local = netobjects_local[index]
-        else:
-            dst_local = 'any'
-
-    # return values
-    return(src_local,dst_local)
+# Access control entry as produced by the tokenizer
+# - action     : permit or deny
+# - proto      : ip, icmp, tcp, udp...
+# - src, dst   : 'any' or (address, prefix length)
+# - src_op/dst_op, src_port/dst_port : port operator (eq, lt, gt, neq, range) and port ('80', '1000-2000'), '' if none.
+#                                      port names of a range are replaced by their numbers, some have dashes (ftp-data)
+# - icmp       : icmp type, '' if none
+# - flags      : remaining keywords (log, established...)
+# - line       : line number in the input file
+class Ace:
+    __slots__ = ('action', 'proto', 'src', 'src_op', 'src_port', 'dst', 'dst_op', 'dst_port', 'icmp', 'flags', 'line')
+
+    def __init__(self,action,proto,src,src_op,src_port,dst,dst_op,dst_port,icmp,flags,line):
+        self.action = action
+        self.proto = proto
+        self.src = src
+        self.src_op = src_op
+        self.src_port = src_port
+        self.dst = dst
+        self.dst_op = dst_op
+        self.dst_port = dst_port
+        self.icmp = icmp
+        self.flags = flags
+        self.line = line
+
+# Function: Read address at position pos: any, host <ip> or <ip> <wildcard mask>
+# Returns address ('any' or (address, prefix length), None if invalid) and next position
+def read_address(fields,pos):
+    if pos >= len(fields):
+        return(None,pos)
+    if fields[pos] == 'any':
+        return('any',pos+1)
+    if pos + 1 >= len(fields):
+        return(None,pos)
+    if fields[pos] == 'host':
+        if is_ipv4(fields[pos+1]):
+            return((fields[pos+1],'32'),pos+2)
+        return(None,pos)
+    if is_ipv4(fields[pos]):
+        try:
+            return((fields[pos],convert_wildcard(fields[pos+1])),pos+2)
+        except ValueError:
+            return(None,pos)
+    return(None,pos)
+
+# Function: Read optional port operator and port(s) at position pos (tcp and udp only)
+# Returns operator, port and next position
+def read_port(fields,pos,proto):
+    if proto in ports_protocols and pos < len(fields):
+        if fields[pos] in port_operators and pos + 1 < len(fields):
+            return(fields[pos],fields[pos+1],pos+2)
+        if fields[pos] == 'range' and pos + 2 < len(fields):
+            low, high = (port_number(proto,value) for value in fields[pos+1:pos+3])
+            if low is None or high is None:
+                return('range',fields[pos+1] + '-' + fields[pos+2],pos+3)
+            return('range',str(low) + '-' + str(high),pos+3)
+    return('','',pos)
+
+# Function: Tokenize one acl line in a single pass from left to right:
+# [sequence] action protocol source [source port] destination [destination port] [icmp type] [flags]
+# Returns Ace or the reason, why the line cannot be translated
+def tokenize(fields,line_number):
+    pos = 0
+    if fields[pos].isdigit():
+        pos += 1
+    if pos + 1 >= len(fields) or fields[pos] not in actions:
+        return('no permit or deny entry')
+    action = fields[pos]
+    proto = fields[pos+1]
+    src, pos = read_address(fields,pos+2)
+    if src is None:
+        return('unsupported source')
+    src_op, src_port, pos = read_port(fields,pos,proto)
+    dst, pos = read_address(fields,pos)
+    if dst is None:
+        return('unsupported destination')
+    dst_op, dst_port, pos = read_port(fields,pos,proto)
+    icmp = ''
+    if proto == 'icmp' and pos < len(fields) and fields[pos] not in ('log', 'log-input'):
+        icmp = fields[pos]
+        pos += 1
+    return(Ace(action,proto,src,src_op,src_port,dst,dst_op,dst_port,icmp,tuple(fields[pos:]),line_number))
+
+# Function: Tokenize acl lines and filter entries that cannot be translated properly
+# Returns list of Ace, skipped lines are added to skipped as (line number, reason) if given
+# start is the line number of the first line in the input file
+def parse_acls(ciscoacls,skipped=None,start=1):
+
+    aces = []
+    acl_type = ''
+    if skipped is None:
+        skipped = []
+
+    # Loop through file containing cisco acls
+    for line_number, line in enumerate(ciscoacls, start=start):
+        # Transform line to list, skip empty lines
+        fields = line.split()
+        if not fields:
+            continue
 
-# Function: Convert Cisco ip acl to "any" rule
-def create_ip_rule (acl_local,netobjects_local):
+        # This is a named access list, so first access-list line always contains name and no rules
+        if fields[0] == 'ip' and fields[1] == 'access-list':
+            acl_type = fields[2]
+            continue
 
-    rule_local = []
+        # Skip standard acls and remarks for the moment...
+        if acl_type == 'standard' or fields[0] == 'remark' or (fields[0].isdigit() and fields[1:2] == ['remark']):
+            continue
 
-    # Set action based on acl[0]
-    if acl_local[0] == 'permit':
-        action = 'accept'
-    else:
-        action = 'drop'
+        ace = tokenize(fields,line_number)
+        if isinstance(ace, str):
+            skipped.append((line_number,ace))
+            continue
 
-    # This is an "ip any" ACL
-    proto = 'ip'
-    service = 'any'
+        ###
+        # Begin filter section: Skip rules that cannot be translated properly
+
+        # Acls for "established" connections
+        if 'established' in ace.flags:
+            skipped.append((line_number,'established'))
+        # Acls for ospf connections
+        elif ace.proto == 'ospf':
+            skipped.append((line_number,'ospf'))
+        # Rules with source port set
+        elif ace.src_op:
+            skipped.append((line_number,'source port'))
+        # Any-Any rules ("permit ip any any")
+        elif ace.src == 'any' and ace.dst == 'any' and not ace.dst_op and not ace.icmp:
+            skipped.append((line_number,'any rule'))
+        else:
+            aces.append(ace)
 
-    srcdst = get_src_dst(acl_local,netobjects_local)
-    source = srcdst[0]
-    destination = srcdst[1]
+        # End filter section
+        ####
 
-    rule_local=[proto,source,destination,service,action]
-    return(rule_local)
+    return(aces)
 
-# Function: Convert Cisco icmp acl
-def create_icmp_rule (acl_local,netobjects_local):
+# Function: Collect network objects from filtered acls
+# Returns object index: (address, prefix length) -> object ('address/prefix length'), in order of appearance
+def collect_objects(aces):
 
-    rule_local = []
+    netobjects_local = {}
 
-    # Set action based on acl[0]
-    if acl_local[0] == 'permit':
-        action = 'accept'
-    else:
-        action = 'drop'
-
-    # This is an icmp ACL, typecode defaults to any
-    proto = 'icmp'
-    service = 'any'
-
-    srcdst = get_src_dst(acl_local,netobjects_local)
-    source = srcdst[0]
-    destination = srcdst[1]
-
-    # get icmp type 
-    if source == 'any':
-        if destination == 'any':
-            try: 
-                service = acl_local[4]
-            except IndexError:
-                service = 'any'
-        else:
-            try: 
-                service = acl_local[5]
-            except IndexError:
-                service = 'any'
-    else:
-        if destination == 'any':
-            try: 
-                service = acl_local[5]
-            except IndexError:
-                service = 'any'
-        else:
-            try: 
-                service = acl_local[6]
-            except IndexError:
-                service = 'any'
+    for ace in aces:
+        for key in (ace.src, ace.dst):
+            if not key == 'any' and key not in netobjects_local:
+                netobjects_local[key] = key[0] + '/' + key[1]
 
-    rule_local=[proto,source,destination,service,action]
-    return(rule_local)
+    return(netobjects_local)
 
-# Function: Convert Cisco tcp/udp acl
-def create_tcpudp_rule(acl_local,netobjects_local):
+# Function: Build rules from filtered acls in a single pass, in the order of the acl.
+# Rules are tuples:
+# - ip:      (proto, source, destination, 'any', action)
+# - icmp:    (proto, source, destination, icmp type or 'any', action)
+# - tcp/udp: (proto, source, destination, operator, port or 'any', action)
+# Rules that make no sense on a firewall are dropped here already.
+# Returns candidate rules as (rule, line number) and skipped acls as (line number, reason)
+def build_rules(aces,netobjects_local):
 
-    rule_local = []
+    candidates = []
+    skipped_local = []
 
-    # Set action based on acl[0]
-    if acl_local[0] == 'permit':
-        action = 'accept'
-    else:
-        action = 'drop'
-
-    # port defaults to any
-    proto = acl[1]
-    port = 'any'
-
-    srcdst = get_src_dst(acl_local,netobjects_local)
-    source = srcdst[0]
-    destination = srcdst[1]
-
-    # get service operator (eq,lt,gt,neq,range)
-    operator = ''
-    if source == 'any':
-        if destination == 'any':
-            try:
-                operator = acl_local[4]
-                pos = 5
-            except IndexError:
-                port = 'any'
+    for ace in aces:
+        # Set action
+        if ace.action == 'permit':
+            action = 'accept'
         else:
-            try:
-                operator = acl_local[5]
-                pos = 6
-            except IndexError:
-                port = 'any'
-    else:
-        if destination == 'any':
-            try:
-                operator = acl_local[5]
-                pos = 6
-            except IndexError:
-                port = 'any'
-        else:
-            try:
-                operator = acl_local[6]
-                pos = 7
-            except IndexError:
-                port = 'any'
-
-    # set operator and port for output
-    single_port = ['eq','lt','gt','neq']
-    if operator == 'range':
-        port = str(acl_local[pos]) + '-' + str(acl_local[pos+1])
-    elif operator in single_port:
-        port = str(acl_local[pos])
-    else:
-        operator = ''
-
-    rule_local=[proto,source,destination,operator,port,action]
-    return(rule_local)
-
-# Function: Check for rule duplicate 
-def is_dup(rule_local,rulebase_local):
-    for rule_check in rulebase_local:
-        if rule_check:
-            if rule_local == rule_check:
-                return(True)
-    return(False)
-
-# Funtion: Check if there is already a rule with same source and destination
-def is_any_rule(rule_local,rulebase_local):
-    for rule_check in rulebase_local:
-        if rule_check[1] == rule_local[1]:
-            if rule_check[2] == rule_local[2]:
-                return(True)
+            action = 'drop'
+
+        # Source and destination from object index
+        source = 'any' if ace.src == 'any' else netobjects_local[ace.src]
+        destination = 'any' if ace.dst == 'any' else netobjects_local[ace.dst]
+
+        if ace.proto == 'ip':
+            rule = ('ip',source,destination,'any',action)
+        elif ace.proto == 'icmp':
+            rule = ('icmp',source,destination,ace.icmp or 'any',action)
+            # allowing echo-reply doesn't make sense in a stateful firewall
+            if ace.icmp == 'echo-reply':
+                skipped_local.append((ace.line,'echo-reply'))
+                continue
+        elif ace.proto in ports_protocols:
+            rule = (ace.proto,source,destination,ace.dst_op,ace.dst_port or 'any',action)
         else:
-            return(False)
-
-# Open ACL file and read contents into list
-with open(infile) as aclfile:
-    ciscoacls = aclfile.readlines()
-
-# Initialize num and skipped rules
-num = 0
-skipped = 0
-
-####
-# Object extraction and filtering
-####
-
-# Loop through file containing cisco acls, filter unwanted and collect network objects 
-for line in ciscoacls:
-    # Remove leading and trailing whitespace if any
-    line.strip(' ')
-    # Transform line to list
-    acl = line.split()
-
-    # This is a named access list, so first access-list line always contains name and no rules
-    if acl[1] == 'access-list':
-        acl_type = acl[2]
-        rule_name = acl[3]
-        continue
-
-    # Skip standard acls for the moment...
-    if acl_type == 'standard':
-        continue
-
-    ###
-    # Begin filter section: Skip rules that cannot be translated properly
-
-    # Delete log keyword
-    last = acl[-1]
-    if last == 'log':
-        del acl[-1]
-    # Acls for "established" connections
-    established = re.search(established_pattern, line)
-    if established:
-        continue
-    # Acls for ospf connections
-    ospf = re.search(ospf_pattern, line)
-    if ospf:
-        continue
-    # Source = any rules with source port set
-    if acl[2] == 'any':
-        if acl[3] == 'eq':
-            continue
-        if acl[3] == 'range':
+            skipped_local.append((ace.line,'protocol ' + ace.proto + ' not supported'))
             continue
-    # Rules with source port and source host set 
-    if not (acl[2] == 'any'):
-        if acl[4] == 'eq':
-            continue
-        if acl[4] == 'range':
-            continue
-    # Any-Any rules ("permit ip any any")
-    if len(acl) == 4:
-        continue
 
-    # End filter section 
-    ####
+        candidates.append((rule,ace.line))
 
-    ####
-    # Collect network objects
-
-    # Loop through complete line
-    num = len(acl)
-    for index in range(0, num):
-        # If host keyword found, next field is ip address
-        if acl[index] == 'host':
-            nextindex = index + 1
-            # Check if valid ip address
-            if is_ipv4(acl[nextindex]):
-                # Check if hostobject already in list and add, if not
-                hostobject = acl[nextindex] + '/32'
-                hostcheck = netobjects.count(hostobject)
-                if not hostcheck:
-                    netobjects.append(hostobject)
-        # Check if field is wildcard mask
-        wildcard = re.search(wildcard_pattern, acl[index])
-        # If yes, then previous field contains network address
-        if wildcard:
-            # Check if valid ipv4 address
-            lastindex = index - 1
-            if is_ipv4(acl[lastindex]):
-                netobject = acl[lastindex] + '/' + convert_wildcard(acl[index]) 
-                netcheck = netobjects.count(netobject)
-                if not netcheck:
-                    netobjects.append(netobject)
-
-    # End of collect section
-    ####
+    return(candidates,skipped_local)
+
+# Function: Object ('address/prefix length' or 'any') as (network as int, prefix length)
+# The address is masked, acls may have host bits set in it (10.1.1.5 0.0.0.255).
+@lru_cache(maxsize=65536)
+def prefix_key(netobject):
+    if netobject == 'any':
+        return((0,0))
+    address, prefixlen = netobject.split('/')
+    return((int(ipaddress.IPv4Address(address)) & (0xffffffff << 32 - int(prefixlen)) & 0xffffffff,int(prefixlen)))
 
-    # store filtered version of ciscoacls
-    #acl.append(rule_name)
-    ciscoacls_filtered.append(acl)
+# Function: Port or port name as number (None if unknown name)
+def port_number(proto,port):
+    return(aclformat.port_number(proto,port))
 
-####
-# Rules section
+# Function: Ports of a tcp/udp rule as tuple of (low, high) intervals, None if a port name is unknown
+def port_set(proto,operator,port):
+    if port == 'any':
+        return(((0,65535),))
+    if operator == 'range':
+        if aclformat.port_range(proto,port) is None:
+            return(None)
+        return((aclformat.port_range(proto,port),))
+    number = port_number(proto,port)
+    if number is None:
+        return(None)
+    if operator == 'lt':
+        return(((0,number-1),))
+    if operator == 'gt':
+        return(((number+1,65535),))
+    if operator == 'neq':
+        return(((0,number-1),(number+1,65535)))
+    return(((number,number),))
+
+# Function: Does the service part (protocol, icmp type, ports) of rule a cover the one of rule b?
+# services are (protocol, icmp type or port set)
+def service_covers(service_a,service_b,rule_a,rule_b):
+    proto_a, ports_a = service_a
+    proto_b, ports_b = service_b
+    if proto_a == 'ip':
+        return(True)
+    if not proto_a == proto_b:
+        return(False)
+    if proto_a == 'icmp':
+        return(ports_a == 'any' or ports_a == ports_b)
+    if ports_a is None or ports_b is None:
+        # unknown port name, only an identical port matches
+        return(rule_a[3:5] == rule_b[3:5])
+    return(all(any(low_a <= low_b and high_b <= high_a for low_a, high_a in ports_a) for low_b, high_b in ports_b))
+
+# Function: Earlier rules whose source and destination contain the ones of a rule.
+# The index is a prefix trie flattened to dicts: source prefix -> destination prefix -> rules.
+# All prefixes containing an address are its network at every shorter prefix length, so only
+# the prefix lengths actually used in the index have to be looked up.
+def covering_rules(index,src_lengths,src,dst):
+    src_address, src_len = src
+    dst_address, dst_len = dst
+    for length in src_lengths:
+        if length > src_len:
+            continue
+        dst_index = index.get((src_address & (0xffffffff << 32 - length) & 0xffffffff, length))
+        if dst_index is None:
+            continue
+        for dst_length in dst_index[0]:
+            if dst_length > dst_len:
+                continue
+            yield from dst_index[1].get((dst_address & (0xffffffff << 32 - dst_length) & 0xffffffff, dst_length), ())
+
+# Function: Remove duplicate rules and rules already covered by an earlier rule.
+# Rules are tuples, so duplicates are dict lookups. A rule is covered, if an earlier rule matches
+# all of its traffic (source and destination contain the ones of the rule, ip or same protocol,
+# port range or icmp type contained), so it never matches on the firewall:
+# - same action: redundant, removed and its acl lines added to the covering rule
+# - different action: conflict, the rule is kept for manual verification and added to conflicts
+#   as (line number, reason) if conflicts is given
+# first is the number of the first rule (rules of several acls go to one rules file).
+# Candidates that cannot be covered are found using an index of the earlier rules, see covering_rules.
+# Returns rules as dict rule -> acl line numbers (first one created the rule, the others were
+# collapsed into it) in order of appearance, and removed acls as (line number, reason)
+def dedupe_rules(candidates,conflicts=None,first=1):
+
+    rules_local = {}
+    rule_numbers = {}
+    index = {}
+    src_lengths = set()
+    skipped_local = []
+    if conflicts is None:
+        conflicts = []
+
+    for rule, line in candidates:
+        # check if there is already an identical rule
+        if rule in rules_local:
+            rules_local[rule].append(line)
+            skipped_local.append((line,'collapsed into rule ' + str(rule_numbers[rule])))
+            continue
 
-# Loop through filterd acl, ip (src/dst/any) rules first
-for acl in ciscoacls_filtered:
-    if acl[1] == 'ip':
-        rule = create_ip_rule(acl,netobjects)
-        # Dont export "any-rules"
-        if 'any' in rule[1] and 'any' in rule[2] and 'any' in rule[3]:
-            skipped += 1
+        # check if an earlier rule covers this one, the first one counts
+        src = prefix_key(rule[1])
+        dst = prefix_key(rule[2])
+        if rule[0] in ports_protocols:
+            service = (rule[0],port_set(rule[0],rule[3],rule[4]))
         else:
-            if is_dup(rule,rules):
-                skipped += 1
-            else:
-                rules.append(rule)
-
-# Remove rules already processed to save time -> does not work on all acls - why?
-for acl in ciscoacls_filtered:
-    if acl[1] == 'ip':
-        ciscoacls_filtered.remove(acl)
-
-# Loop through filterd acl, extract icmp rules
-for acl in ciscoacls_filtered:
-    if acl[1] == 'icmp':
-        rule = create_icmp_rule(acl,netobjects)
-        # Dont export "any-rules"
-        if 'any' in rule[1] and 'any' in rule[2] and 'any' in rule[3]:
-            skipped += 1
+            service = (rule[0],rule[3])
+        action = rule[-1]
+        covering = None
+        for number, earlier, earlier_service in covering_rules(index,sorted(src_lengths),src,dst):
+            if (covering is None or number < covering[0]) and service_covers(earlier_service,service,earlier,rule):
+                covering = (number,earlier)
+        if covering and covering[1][-1] == action:
+            rules_local[covering[1]].append(line)
+            skipped_local.append((line,'covered by rule ' + str(covering[0])))
+            continue
+        if covering:
+            conflicts.append((line,'shadowed by rule ' + str(covering[0]) + ' with different action'))
+
+        rules_local[rule] = [line]
+        rule_numbers[rule] = len(rule_numbers) + first
+        src_lengths.add(src[1])
+        dst_index = index.setdefault(src,(set(),{}))
+        dst_index[0].add(dst[1])
+        dst_index[1].setdefault(dst,[]).append((rule_numbers[rule],rule,service))
+
+    return(rules_local,skipped_local)
+
+# Function: Address cell of a rule ('any' or object) as 'any' or tuple of networks
+# (host bits of the address are dropped, ios accepts 10.1.1.5 0.0.0.255)
+def cell_networks(netobject):
+    if netobject == 'any':
+        return('any')
+    return((ipaddress.IPv4Network(netobject,strict=False),))
+
+# Function: Union of address cells as 'any' or tuple of networks (minimal cidr set)
+def collapse_cells(cells):
+    networks = []
+    for cell in cells:
+        if cell == 'any':
+            return('any')
+        networks.extend(cell)
+    return(tuple(ipaddress.collapse_addresses(networks)))
+
+# Function: Merge rules that differ only in one address cell (position 1 = source, 2 = destination)
+# rules are lists [rule as list with cells, acl lines, old rule numbers], merged ones keep the
+# position of the first one.
+def merge_cells(rules_local,position):
+    merged = {}
+    for rule, lines, numbers in rules_local:
+        key = tuple(rule[:position]) + (None,) + tuple(rule[position+1:])
+        if key in merged:
+            merged[key][0][position].append(rule[position])
+            merged[key][1].extend(lines)
+            merged[key][2].extend(numbers)
         else:
-            # check if there is already an identical rule
-            if is_dup(rule,rules):
-                skipped += 1
-            else:
-                # check if there is already an ip-any rule with same source and destination
-                if is_any_rule(rule,rules):
-                    skipped += 1
+            cells = list(rule)
+            cells[position] = [rule[position]]
+            merged[key] = [cells, list(lines), list(numbers)]
+    for rule, lines, numbers in merged.values():
+        rule[position] = collapse_cells(rule[position])
+    return(list(merged.values()))
+
+# Function: Aggregate network objects of rules. Rules with the same action that differ only in source
+# (then: only in destination) are merged, their addresses collapsed into the minimal cidr set.
+# A single network is used as object ('address/prefix length'), more networks become a group
+# named group_prefix + hash of the members. Only rules between two rules with a different action are
+# merged, so the first match of every packet is still the same.
+# first is the number of the first rule (see dedupe_rules)
+# Returns rules (see dedupe_rules), objects for the objects file (networks as 'address/prefix length',
+# groups as 'name member member...', members first) and old rule number -> new rule number
+def aggregate_rules(rules_local,first=1):
+
+    runs = []
+    for number, (rule, lines) in enumerate(rules_local.items(), start=first):
+        entry = [[rule[0], cell_networks(rule[1]), cell_networks(rule[2])] + list(rule[3:]), lines, [number]]
+        if runs and runs[-1][-1][0][-1] == rule[-1]:
+            runs[-1].append(entry)
+        else:
+            runs.append([entry])
+
+    aggregated = {}
+    objects_local = {}
+    rule_numbers = {}
+    for run in runs:
+        for rule, lines, numbers in merge_cells(merge_cells(run,1),2):
+            for position in (1, 2):
+                cell = rule[position]
+                if cell == 'any':
+                    continue
+                members = [str(network) for network in cell]
+                for member in members:
+                    objects_local.setdefault(member, member)
+                if len(members) == 1:
+                    rule[position] = members[0]
                 else:
-                    # allowing echo-reply doesn't make sense in a stateful firewall
-                    if 'echo-reply' in rule[3]:
-                        skipped += 1
-                    else:
-                        rules.append(rule)
-
-# Cleanup 
-for acl in ciscoacls_filtered:
-    if acl[1] == 'icmp':
-        ciscoacls_filtered.remove(acl)
-
-# Get tcp and udp rules
-for acl in ciscoacls_filtered:
-    if acl[1] == 'udp' or acl[1] == 'tcp':
-        if acl[2] == 'any':
-            if acl[3] == 'eq':
-                skipped += 1
-                continue
-        elif acl[4] == 'eq':
-            skipped += 1
+                    rule[position] = group_prefix + hashlib.sha1(' '.join(members).encode()).hexdigest()[:12]
+                    objects_local.setdefault(rule[position], rule[position] + ' ' + ' '.join(members))
+            rule = tuple(rule)
+            # merging the source first can produce rules that are equal after merging the destination
+            if rule in aggregated:
+                aggregated[rule].extend(lines)
+            else:
+                aggregated[rule] = lines
+            for number in numbers:
+                rule_numbers[number] = rule
+    new_numbers = { rule : number for number, rule in enumerate(aggregated, start=first) }
+    rule_numbers = { number : new_numbers[rule] for number, rule in rule_numbers.items() }
+    for rule in aggregated:
+        aggregated[rule].sort()
+
+    return(aggregated,objects_local,rule_numbers)
+
+# Function: Type of numbered acl ('standard', 'extended' or '' if unsupported)
+def numbered_type(number):
+    if number.isdigit():
+        for numbers, acl_type in ((standard_numbers,'standard'),(extended_numbers,'extended')):
+            if any(int(number) in valid for valid in numbers):
+                return(acl_type)
+    return('')
+
+# Function: Find acls in a config, e.g. a "show running-config" output.
+# Reads lines lazily from any iterable (like an open file) and yields one acl at a time as
+# (name, type, line number of first line, lines), so only one acl is held in memory.
+# - named acls:    "ip access-list extended NAME" followed by its entries
+# - numbered acls: consecutive "access-list 101 ..." lines, prefix removed from the lines
+# Blank lines don't end an acl. Everything else in the config is ignored, except acl entries
+# outside of an acl: they are added to skipped as (line number, reason) if given.
+def iter_acls(config,skipped=None):
+
+    block = None
+    if skipped is None:
+        skipped = []
+
+    for line_number, line in enumerate(config, start=1):
+        fields = line.split()
+
+        # Keep blank lines in the acl, so line numbers stay right (parse_acls skips them)
+        if block and not fields:
+            block[4].append(line)
             continue
-        else:
-            rule = create_tcpudp_rule(acl,netobjects)
-            # check if there is already an identical rule
-            if is_dup(rule,rules):
-                skipped += 1
+        # Entries of a named acl are indented, some exports lose that, so accept entry keywords too
+        if block and block[1] == 'named' and fields and (line[0].isspace() or fields[0] in actions or fields[0] == 'remark' or fields[0].isdigit()):
+            block[4].append(line)
+            continue
+        # Next entry of the same numbered acl
+        if block and block[1] == 'numbered' and len(fields) > 2 and fields[0] == 'access-list' and fields[1] == block[0]:
+            block[4].append(line.split(None, 2)[2])
+            continue
+        # Anything else ends the current acl
+        if block:
+            yield(block[0],block[2],block[3],block[4])
+            block = None
+
+        if len(fields) == 4 and fields[0] == 'ip' and fields[1] == 'access-list' and fields[2] in ('extended', 'standard'):
+            block = [fields[3], 'named', fields[2], line_number, [line]]
+        elif len(fields) > 2 and fields[0] == 'access-list' and numbered_type(fields[1]):
+            block = [fields[1], 'numbered', numbered_type(fields[1]), line_number, [line.split(None, 2)[2]]]
+        elif fields and (fields[0] in actions or (len(fields) > 1 and fields[0].isdigit() and fields[1] in actions)):
+            skipped.append((line_number,'entry outside of an ip access-list'))
+
+    if block:
+        yield(block[0],block[2],block[3],block[4])
+
+# Function: Complete conversion of acl lines to network objects and rules
+# start: line number of the first acl line, first: number of the first rule
+# aggregate: aggregate objects, see aggregate_rules (object index is then object -> object)
+# Returns object index (only objects used by the rules kept), rules (see dedupe_rules), skipped
+# acls and conflicts as (line number, reason)
+def convert(ciscoacls,start=1,first=1,aggregate=False):
+    skipped_parse = []
+    conflicts = []
+    aces = parse_acls(ciscoacls,skipped_parse,start)
+    netobjects_local = collect_objects(aces)
+    candidates, skipped_build = build_rules(aces,netobjects_local)
+    rules_local, skipped_dedupe = dedupe_rules(candidates,conflicts,first)
+    if aggregate:
+        rules_local, netobjects_local, numbers = aggregate_rules(rules_local,first)
+        renumber = lambda match: 'rule ' + str(numbers[int(match.group(1))])
+        skipped_dedupe = [(line, re.sub(r'rule (\d+)', renumber, reason)) for line, reason in skipped_dedupe]
+        conflicts = [(line, re.sub(r'rule (\d+)', renumber, reason)) for line, reason in conflicts]
+    else:
+        # objects of dropped and collapsed rules are not exported
+        used = { cell for rule in rules_local for cell in (rule[1], rule[2]) }
+        netobjects_local = { key : netobject for key, netobject in netobjects_local.items() if netobject in used }
+    return(netobjects_local,rules_local,sorted(skipped_parse + skipped_build + skipped_dedupe),conflicts)
+
+# Function: Convert all acls in a config, one acl at a time
+# Yields (name, type, line number, number of first rule, object index, rules, skipped acls, conflicts)
+# per acl, see convert. Rules are numbered across all acls.
+# Standard acls are not converted (no objects and rules, only a skip entry).
+# names: only convert acls with these names or numbers (all if empty)
+# skipped: list for acl entries outside of an acl, see iter_acls
+def convert_config(config,names=(),aggregate=False,skipped=None):
+    first = 1
+    for name, acl_type, line_number, lines in iter_acls(config,skipped):
+        if names and name not in names:
+            continue
+        if acl_type == 'standard':
+            yield(name,acl_type,line_number,first,{},{},[(line_number,'standard acl')],[])
+            continue
+        netobjects_local, rules_local, skipped_local, conflicts = convert(lines,line_number,first,aggregate)
+        yield(name,acl_type,line_number,first,netobjects_local,rules_local,skipped_local,conflicts)
+        first += len(rules_local)
+
+# Function: Convert a config file and write rules and report.
+# Acls are read, converted and written one after the other, so memory use depends on the
+# biggest acl only, not on the size of the config. Rules of all acls go to one rules file
+# (rule number = record number in rules file), the report tells which rules belong to which acl.
+# Returns objects (deduplicated, in order of appearance), number of acls and rules
+def convert_file(config_file,rules_file,report_file,names=(),verbose=False,aggregate=False):
+
+    objects_local = {}
+    rule_count = 0
+    acl_count = 0
+    skipped_config = []
+    with open(config_file) as config, aclformat.Writer(rules_file, 'rules') as rule_output, open(report_file, 'w+') as report:
+        for name, acl_type, line_number, first, netobjects_local, rules_local, skipped_local, conflicts in convert_config(config, names, aggregate, skipped_config):
+            acl_count += 1
+            for netobject in netobjects_local.values():
+                objects_local.setdefault(netobject)
+            for rule, lines in rules_local.items():
+                rule_output.write(aclformat.rule_record(rule, name, lines))
+            # which acl lines were skipped or collapsed into which rule, and rules to verify manually
+            rule_count += len(rules_local)
+            if rules_local:
+                print('acl ' + name + ' (' + acl_type + ', line ' + str(line_number) + '): rules ' + str(first) + '-' + str(rule_count), file=report)
             else:
-                # check if there is already an ip-any rule with same source and destination
-                if is_any_rule(rule,rules):
-                    skipped += 1
-                else:
-                    rules.append(rule)
-
-# End of rules section
-####
-
-####
-# Output section
-# Screen output of objects, rules and acls for manual verification purposes (uncomment below)
-print('#######################################')
-print('# Cisco to Check Point ACL Conversion #')
-print('#######################################')
-print()
-#print('Raw ACLs:')
-#print(*ciscoacls)
-#print('---------------')
-#print('Filtered ACLs:')
-#print(*ciscoacls_filtered, sep = '\n')
-#print('---------------')
-#print('Network objects:')
-#print(*netobjects, sep = '\n')
-#print('---------------')
-#print('Firewall rules:')
-#print(*rules, sep = '\n')
-#print('Skipped rules:',str(skipped))
-
-# output to files for further processing
-with open(objects_out, 'w+') as file:
-    file.writelines([netobject + '\n' for netobject in netobjects])
-with open(rules_out, 'w+') as output:
-    for rule in rules:
-        print(rule, file=output) 
-
-print('Rules and objects exported. Import using import-acl.py.')
+                print('acl ' + name + ' (' + acl_type + ', line ' + str(line_number) + '): no rules', file=report)
+            for number, rule in enumerate(rules_local, start=first):
+                print('rule ' + str(number) + ': acl line(s) ' + ', '.join(str(line) for line in rules_local[rule]), file=report)
+            for line, reason in skipped_local:
+                print('acl line ' + str(line) + ' skipped: ' + reason, file=report)
+            for line, reason in conflicts:
+                print('acl line ' + str(line) + ' conflict: ' + reason, file=report)
+            if verbose:
+                print('acl ' + name + ': ' + str(len(rules_local)) + ' rules, ' + str(len(skipped_local)) + ' lines skipped, ' + str(len(conflicts)) + ' conflicts')
+        for line, reason in skipped_config:
+            print('config line ' + str(line) + ' skipped: ' + reason, file=report)
+        if verbose and skipped_config:
+            print(str(len(skipped_config)) + ' acl entries outside of an ip access-list skipped')
+
+    return(list(objects_local),acl_count,rule_count)
+
+# Function: Write objects file
+def write_objects(objects_file,netobjects_local):
+    with aclformat.Writer(objects_file, 'objects') as output:
+        for netobject in netobjects_local:
+            output.write(aclformat.object_record(netobject))
+
+# Function: Output file name, .gz appended if compressed
+def output_name(name,compress=False):
+    if compress:
+        return(name + '.gz')
+    return(name)
+
+# Function: Device name from config file name (router1.txt -> router1)
+def device_name(config_file):
+    return(os.path.splitext(os.path.basename(config_file))[0])
+
+# Function: Convert the config of one device in batch mode (runs in a worker process)
+# Returns device name, objects, number of acls and rules
+def convert_device(config_file,output_dir,names=(),aggregate=False,compress=False):
+    device = device_name(config_file)
+    rules_file = os.path.join(output_dir, output_name(device_rules_out.format(device), compress))
+    report_file = os.path.join(output_dir, device_report_out.format(device))
+    objects_local, acl_count, rule_count = convert_file(config_file,rules_file,report_file,names,aggregate=aggregate)
+    return(device,objects_local,acl_count,rule_count)
+
+# Function: Config files of a directory or glob pattern, sorted
+def config_files(path):
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in os.listdir(path)]
+    else:
+        files = glob.glob(path)
+    return(sorted(file for file in files if os.path.isfile(file)))
+
+# Function: Batch conversion of many device configs in a process pool.
+# Yields (device, objects, number of acls, number of rules) in the order of config_list,
+# merging is left to the caller.
+def convert_batch(config_list,output_dir,names=(),jobs=None,aggregate=False,compress=False):
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(convert_device, config_list, [output_dir] * len(config_list), [names] * len(config_list), [aggregate] * len(config_list), [compress] * len(config_list))
+
+##################
+### main program
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert Cisco ACLs to Check Point objects and rules.')
+    parser.add_argument('config', nargs='?', default=infile, help='single acl, running-config, or directory/glob of configs for batch mode (default ' + infile + ')')
+    parser.add_argument('--acl', action='append', default=[], help='only convert this acl (name or number, repeatable)')
+    parser.add_argument('--aggregate', action='store_true', help='merge rules and collapse their addresses into minimal cidr sets or groups')
+    parser.add_argument('--gzip', action='store_true', help='gzip compressed objects and rules files')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='batch mode: number of worker processes (default: number of cores)')
+    parser.add_argument('--output', default='.', help='batch mode: directory for objects, rules and report files')
+    args = parser.parse_args()
+
+    ####
+    # Output section
+    print('#######################################')
+    print('# Cisco to Check Point ACL Conversion #')
+    print('#######################################')
+    print()
+
+    # Single config: objects, rules and report to the usual files
+    if os.path.isfile(args.config):
+        netobjects, acl_count, rule_count = convert_file(args.config, output_name(rules_out, args.gzip), report_out, args.acl, verbose=True, aggregate=args.aggregate)
+        write_objects(output_name(objects_out, args.gzip), netobjects)
+        if not acl_count:
+            quit('No acls found in ' + args.config + '.')
+        print(str(acl_count) + ' acls, ' + str(len(netobjects)) + ' objects, ' + str(rule_count) + ' rules exported. Import using import-acl.py.')
+        quit()
+
+    # Batch mode: devices are converted in parallel, objects of all devices are merged into one list
+    # (each object once), rules and report per device
+    config_list = config_files(args.config)
+    if not config_list:
+        quit('No config files found in ' + args.config + '.')
+    devices = [device_name(config_file) for config_file in config_list]
+    if len(set(devices)) < len(devices):
+        quit('Config file names are not unique, rules files would be overwritten.')
+    os.makedirs(args.output, exist_ok=True)
+
+    netobjects = {}
+    acl_count = 0
+    rule_count = 0
+    for device, objects_local, acls, rules in convert_batch(config_list, args.output, args.acl, args.jobs, args.aggregate, args.gzip):
+        for netobject in objects_local:
+            netobjects.setdefault(netobject)
+        acl_count += acls
+        rule_count += rules
+        print(device + ': ' + str(acls) + ' acls, ' + str(len(objects_local)) + ' objects, ' + str(rules) + ' rules')
+    write_objects(os.path.join(args.output, output_name(objects_out, args.gzip)), netobjects)
+
+    print(str(len(config_list)) + ' devices, ' + str(acl_count) + ' acls, ' + str(len(netobjects)) + ' objects, ' + str(rule_count) + ' rules exported. Import using import-acl.py.')
+
+### end main program
+##################
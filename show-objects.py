@@ -6,11 +6,8 @@
 # dj0Nz feb 2024
 
 # modules needed to query mgmt api, parse input and format output 
-import os, requests, json, netrc, re, sys, socket
-
-# next two lines needed to suppress warnings if self signed certificates are used
-from urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+import os, json, re, sys, socket
+import cpapi
 
 ##################
 # Variables
@@ -33,6 +30,9 @@ if not exists:
 
 # check if port open
 def port_open(ip,port):
+    # host may be given as address:port, e.g. for a local test server (mock-mgmt.py)
+    if ':' in ip:
+        ip, port = ip.rsplit(':', 1)
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
         sock.settimeout(1)
@@ -41,36 +41,6 @@ def port_open(ip,port):
     except:
         return False
 
-# do web_api call and return json structure to work on
-def api_call(ip_addr, command, json_payload, sid):
-    url = 'https://' + ip_addr + '/web_api/' + command
-    if sid == '':
-        request_headers = {'Content-Type' : 'application/json'}
-    else:
-        request_headers = {'Content-Type' : 'application/json', 'X-chkp-sid' : sid}
-    response = requests.post(url,data=json.dumps(json_payload), headers=request_headers, verify = False)
-    status_code = response.status_code
-    return [status_code, response.json()]
-
-# login: read netrc file and extract credentials for host if any
-# then do login and return sid or login error
-def api_login(cp_mgmt,netrc_file):
-    # get login credentials from .netrc file
-    auth = netrc.netrc(netrc_file)
-    token = auth.authenticators(cp_mgmt)
-    if token:
-        user = token[0]
-        password = token[2]
-    else:
-        quit('Host not found in netrc file.')
-    # do login
-    payload_local = {'user':user, 'password' : password}
-    response = api_call(cp_mgmt,'login',payload_local,'')
-    if str(response[0]) == '200':
-        return response[1]["sid"]
-    else:
-        return 'Login error'
-
 # End functions section
 ##################
 
@@ -82,7 +52,10 @@ if not port_open(host,443):
     quit('Management unrechable.')
 
 # get session id needed to authorize api call
-sid = api_login(host,auth_file)
+client = cpapi.Client(host)
+sid = client.login_netrc(auth_file, cache=True)
+if sid == 'Host not found in netrc file.':
+    quit(sid)
 if sid == 'Login error':
     quit('Login error.')
 
@@ -92,42 +65,33 @@ try:
 except IndexError:
     quit('No input.')
 
-# see api documentation for explanation of limit and offset settings. below values for them are defaults. 
+# limit is the page size only, cpapi reads all pages and the output starts with the first one
 payload = { 
-  "limit" : 5, 
-  "offset" : 0, 
   "filter" : input 
 }
+limit = 50
 
-# issue api call and store response elements (0 = response code, 1 = data)
-response = api_call(host, 'show-objects', payload, sid)
-limit = payload['limit']
-if str(response[0]) == '200':
-    total = response[1]['total']
-    if total == 1:
-        print(json.dumps(response[1]['objects'][0], indent=2))
-    elif total == 0:
-        print('No objects matching search pattern (\"' + input + '\")', sep='')
-    elif total > limit:
-        print('Request returned ' + str(total) + ' elements, which is more than the currently configured limit (' + str(limit) + ').', sep='')
-    else:
-        print('There are ' + str(total) + ' objects matching search pattern (\"' + input + '\"):', sep='')
-        num = 0
-        while num < total:
-            object_name = json.dumps(response[1]['objects'][num]['name']).strip('"')
-            print(object_name)
-            num = num +1
-else:
+# issue api call(s) and print matching objects
+try:
+    for page in client.iter_pages('show-objects', payload, limit):
+        total = page['total']
+        if total == 1:
+            print(json.dumps(page['objects'][0], indent=2))
+        elif total == 0:
+            print('No objects matching search pattern (\"' + input + '\")', sep='')
+        else:
+            if page.get('from', 1) == 1:
+                print('There are ' + str(total) + ' objects matching search pattern (\"' + input + '\"):', sep='')
+            for found_object in page['objects']:
+                print(found_object['name'])
+except cpapi.ApiError as error:
     print('Unknown response:') 
-    print(json.dumps(response[1], indent=2))
+    print(json.dumps(error.data, indent=2))
 
 
 ### end main program
 ##################
 
 ##################
-# be nice and log out
-logout_result = api_call(host, "logout",{},sid)
-logout_message = logout_result[1]['message']
-if logout_message != 'OK':
-    print('Logout unsuccessful.')
+# no logout: the session is cached and reused by the next run (see cpapi.Client.login)
+client.close()